@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, Any
+
+import fastapi
+
+from .config import settings
+from .security import has_valid_api_key
+
+if TYPE_CHECKING:
+    from collections.abc import Collection
+
+    from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class UploadRejected(Exception):  # noqa: N818
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UploadAdmission:
+    """Caps concurrent uploads and the request bytes they hold, with a short bounded queue
+
+    A limit of 0 turns that limit off. Requests that can't get in within the queue
+    timeout, or that find the queue full, are turned away instead of piling up.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 0,
+        max_bytes: int = 0,
+        *,
+        queue_size: int = 0,
+        queue_timeout: float = 0,
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.inflight_bytes = 0
+        self.queued = 0
+        self.rejected = 0
+        self._condition = asyncio.Condition()
+
+    def _slot_free(self) -> bool:
+        return not self.max_concurrent or self.active < self.max_concurrent
+
+    def _fits(self, size: int) -> bool:
+        # A single request bigger than the budget still gets in once nothing else is running
+        return self._slot_free() and (
+            not self.max_bytes or self.active == 0 or self.inflight_bytes + size <= self.max_bytes
+        )
+
+    def _reject(self) -> UploadRejected:
+        self.rejected += 1
+        if not self._slot_free():
+            return UploadRejected(429, "Too many uploads in progress")
+        return UploadRejected(503, "Upload capacity exhausted")
+
+    async def acquire(self, size: int) -> None:
+        """Wait for room for an upload of `size` bytes, or raise UploadRejected"""
+        async with self._condition:
+            if self._fits(size):
+                self.active += 1
+                self.inflight_bytes += size
+                return
+            if self.queued >= self.queue_size:
+                raise self._reject()
+
+            self.queued += 1
+            try:
+                async with asyncio.timeout(self.queue_timeout):
+                    await self._condition.wait_for(lambda: self._fits(size))
+            except TimeoutError:
+                raise self._reject() from None
+            finally:
+                self.queued -= 1
+
+            self.active += 1
+            self.inflight_bytes += size
+
+    async def release(self, size: int) -> None:
+        async with self._condition:
+            self.active -= 1
+            self.inflight_bytes -= size
+            self._condition.notify_all()
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "active": self.active,
+            "inflight_bytes": self.inflight_bytes,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+
+class AdmissionMiddleware:
+    """Admits upload requests before their body is read, answering overload with Retry-After
+
+    The API key is checked first, so unauthenticated clients can't take upload slots.
+    """
+
+    def __init__(
+        self, app: ASGIApp, admission: UploadAdmission, paths: Collection[str], retry_after: int
+    ) -> None:
+        self.app = app
+        self.admission = admission
+        self.paths = paths
+        self.retry_after = retry_after
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        # Without a declared length, assume the largest body the upload could have
+        size = settings.filesize_limit
+        authorization = None
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit():
+                size = int(value)
+            elif name == b"authorization":
+                authorization = value.decode("latin-1")
+
+        # Unauthenticated requests would otherwise hold slots until the route rejects them
+        if not has_valid_api_key(authorization):
+            response = fastapi.responses.JSONResponse(
+                status_code=403,
+                content={"detail": "Invalid or missing API key"},
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.admission.acquire(size)
+        except UploadRejected as e:
+            response = fastapi.responses.JSONResponse(
+                status_code=e.status_code,
+                content={"detail": e.detail},
+                headers={"Retry-After": str(self.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await self.admission.release(size)
+
+
+# Create a global upload admission instance
+upload_admission = UploadAdmission(
+    settings.upload_max_concurrent,
+    settings.upload_max_inflight_bytes,
+    queue_size=settings.upload_queue_size,
+    queue_timeout=settings.upload_queue_timeout,
+)
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import aiohttp
+
+from .config import settings
+
+
+class HTTPClient:
+    """Application-wide aiohttp session used to fetch remote uploads"""
+
+    def __init__(self) -> None:
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            msg = "HTTP client has not been started"
+            raise RuntimeError(msg)
+        return self._session
+
+    async def start(self) -> None:
+        """Create the pooled session, should be called once on startup"""
+        if self._session is not None:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=settings.http_connection_limit,
+            limit_per_host=settings.http_connection_limit_per_host,
+            ttl_dns_cache=settings.http_dns_cache_ttl,
+            keepalive_timeout=settings.http_keepalive_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=settings.http_total_timeout,
+            connect=settings.http_connect_timeout,
+            sock_read=settings.http_read_timeout,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self) -> None:
+        """Close the session and release all pooled connections"""
+        if self._session is None:
+            return
+        await self._session.close()
+        self._session = None
+
+
+# Create a global HTTP client instance
+http_client = HTTPClient()
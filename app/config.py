@@ -1,7 +1,9 @@
 from __future__ import annotations
 
-from pydantic import Field
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Annotated, Any, Literal
+
+from pydantic import Field, field_validator
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 
 
 class Settings(BaseSettings):
@@ -12,15 +14,191 @@ class Settings(BaseSettings):
     api_key: str = Field(..., description="API key for authentication")
     filesize_limit: int = Field(default=20 * 1024 * 1024, description="Maximum file size in bytes")
     uploads_enabled: bool = Field(default=True, description="Whether uploading is enabled")
+    upload_chunk_size: int = Field(
+        default=64 * 1024, description="Chunk size in bytes used when streaming uploads"
+    )
+    upload_max_concurrent: int = Field(
+        default=16, description="Uploads handled at the same time, 0 for no limit"
+    )
+    upload_max_inflight_bytes: int = Field(
+        default=256 * 1024 * 1024,
+        description="Request bytes all running uploads may hold together, 0 for no limit",
+    )
+    upload_queue_size: int = Field(
+        default=64, description="Uploads that may wait for room before new ones are rejected"
+    )
+    upload_queue_timeout: float = Field(
+        default=10, description="Seconds an upload waits for room before it is rejected"
+    )
+    upload_retry_after: int = Field(
+        default=1, description="Retry-After seconds sent with rejected uploads"
+    )
+    cpu_pool_kind: Literal["process", "thread", "none"] = Field(
+        default="process",
+        description="Where CPU-heavy upload work such as decoding and PNG conversion runs, 'none' for the event loop",
+    )
+    cpu_pool_workers: int = Field(default=2, description="Number of CPU pool workers")
+    cpu_offload_threshold: int = Field(
+        default=1024 * 1024,
+        description="Base64 inputs smaller than this many bytes are decoded inline, as the hop costs more",
+    )
+    loop_monitor_interval: float = Field(
+        default=0.1, description="Seconds between event loop lag samples, 0 to disable"
+    )
+    image_transcode_enabled: bool = Field(
+        default=True, description="Re-encode every upload as an optimized PNG without metadata"
+    )
+    image_max_pixels: int = Field(
+        default=64_000_000, description="Largest image, in pixels, that uploads may decode to"
+    )
+    image_variants: Annotated[list[Literal["webp", "avif"]], NoDecode] = Field(
+        default=[],
+        description="Comma-separated smaller encodings generated in the background for every upload",
+    )
+    image_variant_quality: int = Field(
+        default=80, description="Quality (0-100) of the WebP and AVIF variants"
+    )
+    image_variant_queue_size: int = Field(
+        default=32,
+        ge=1,
+        description="Uploads that may wait for variant generation, later ones get no variants",
+    )
+    resize_sizes: Annotated[list[int], NoDecode] = Field(
+        default=[64, 128, 256, 512, 1024],
+        description="Comma-separated widths and heights that images may be resized to",
+    )
+    resize_cache_dir: str = Field(
+        default="cache", description="Directory resized images are cached in"
+    )
+    resize_cache_max_bytes: int = Field(
+        default=256 * 1024 * 1024, description="Size budget of the resized image cache in bytes"
+    )
+    upload_jobs_enabled: bool = Field(
+        default=False,
+        description="Download URL uploads in the background and answer with 202 and a job id",
+    )
+    upload_jobs_workers: int = Field(
+        default=4, description="Number of URL uploads downloaded at the same time"
+    )
+    upload_jobs_path: str = Field(
+        default="jobs.db", description="SQLite database that persists queued upload jobs"
+    )
+    upload_jobs_retention: float = Field(
+        default=86400, description="Seconds finished jobs are kept for polling, 0 to keep forever"
+    )
+    idempotency_enabled: bool = Field(
+        default=False, description="Replay the stored response for repeated Idempotency-Key uploads"
+    )
+    idempotency_path: str = Field(
+        default="idempotency.db", description="SQLite database of responses by Idempotency-Key"
+    )
+    idempotency_window: float = Field(
+        default=86400, description="Seconds an Idempotency-Key is remembered"
+    )
+    source_cache_enabled: bool = Field(
+        default=False, description="Reuse the stored file when the same URL is uploaded again"
+    )
+    source_cache_path: str = Field(
+        default="sources.db", description="SQLite database mapping source URLs to filenames"
+    )
+    source_cache_ttl: float = Field(
+        default=3600,
+        description="Seconds a source URL is trusted before revalidating it with ETag/Last-Modified",
+    )
+
+    # Outgoing HTTP configuration (used for URL uploads)
+    http_connection_limit: int = Field(
+        default=100, description="Maximum number of simultaneous outgoing connections"
+    )
+    http_connection_limit_per_host: int = Field(
+        default=20, description="Maximum number of simultaneous connections per host"
+    )
+    http_dns_cache_ttl: int = Field(default=300, description="DNS cache TTL in seconds")
+    http_keepalive_timeout: float = Field(
+        default=30, description="How long idle connections are kept alive in seconds"
+    )
+    http_total_timeout: float = Field(default=60, description="Total request timeout in seconds")
+    http_connect_timeout: float = Field(default=10, description="Connection timeout in seconds")
+    http_read_timeout: float = Field(default=30, description="Socket read timeout in seconds")
 
     # Storage configuration
+    stats_enabled: bool = Field(
+        default=True, description="Keep file count and total size in memory"
+    )
+    stats_reconcile_interval: float = Field(
+        default=3600,
+        description="Seconds between storage scans that correct the in-memory stats, 0 to disable",
+    )
     storage_type: str = Field(default="local", description="Storage type: 'local' or 's3'")
+    dedup_enabled: bool = Field(
+        default=False,
+        description="Store identical uploads once and return the existing filename for duplicates",
+    )
+    dedup_index_path: str = Field(
+        default="dedup.db", description="SQLite database mapping content hashes to filenames"
+    )
+    local_shard_depth: int = Field(
+        default=0,
+        description="Levels of hash-derived subdirectories files are stored under, 0 for a flat layout",
+    )
+    local_durability: Literal["none", "fsync", "group"] = Field(
+        default="none",
+        description="Crash safety of local writes: none, fsync per file, or group commit",
+    )
+    local_group_commit_window: float = Field(
+        default=0.005, description="Seconds concurrent writes wait to share one group commit"
+    )
+    local_index_enabled: bool = Field(
+        default=False, description="Keep a SQLite index of locally stored files"
+    )
+    local_index_path: str = Field(default="index.db", description="Path to the SQLite index")
+    local_scan_workers: int = Field(
+        default=1,
+        description="Threads used to stat files when scanning local storage, >1 helps on network filesystems",
+    )
     s3_endpoint_url: str | None = Field(default=None, description="S3 endpoint URL")
     s3_access_key_id: str | None = Field(default=None, description="S3 access key ID")
     s3_secret_access_key: str | None = Field(default=None, description="S3 secret access key")
     s3_bucket_name: str | None = Field(default=None, description="S3 bucket name")
     s3_region: str = Field(default="auto", description="S3 region")
     s3_custom_domain: str | None = Field(default=None, description="Custom domain for S3 file URLs")
+    s3_max_pool_connections: int = Field(
+        default=50, description="Maximum number of pooled connections to S3"
+    )
+    s3_parallel_listing: bool = Field(
+        default=False, description="List the bucket concurrently by filename prefix"
+    )
+    s3_listing_concurrency: int = Field(
+        default=8, description="Maximum number of prefixes listed at the same time"
+    )
+    s3_multipart_threshold: int = Field(
+        default=16 * 1024 * 1024, description="Files at least this many bytes use multipart upload"
+    )
+    s3_multipart_part_size: int = Field(
+        default=8 * 1024 * 1024,
+        ge=5 * 1024 * 1024,
+        description="Part size in bytes for multipart uploads, at least 5MiB",
+    )
+    s3_multipart_concurrency: int = Field(
+        default=4, description="Parts of one multipart upload sent at the same time"
+    )
+    s3_multipart_retries: int = Field(
+        default=3, description="Times a failed part is retried before the upload is aborted"
+    )
+    s3_presign_expiry: int = Field(
+        default=3600, description="Seconds a presigned direct upload URL stays valid"
+    )
+    s3_presign_path: str = Field(
+        default="presigns.db",
+        description="SQLite database of direct uploads that haven't been completed yet",
+    )
+
+    @field_validator("image_variants", "resize_sizes", mode="before")
+    @classmethod
+    def split_list(cls, value: Any) -> Any:
+        if isinstance(value, str):
+            return [item.strip() for item in value.split(",") if item.strip()]
+        return value
 
 
 # Create a global settings instance
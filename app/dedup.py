@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from .index import SQLiteStore
+
+if TYPE_CHECKING:
+    import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    refcount INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class DedupIndex(SQLiteStore):
+    """Maps content hashes to stored filenames, with a reference count per stored file
+
+    Every upload of identical content shares one stored file. Deleting the file only
+    removes it from storage once every upload that returned it has been deleted.
+    """
+
+    schema = SCHEMA
+
+    async def acquire(self, digest: str) -> str | None:
+        """Take a reference to the file stored for this hash and return its filename
+
+        Returns None if no file with this content has been stored yet.
+        """
+
+        def acquire(conn: sqlite3.Connection) -> str | None:
+            with conn:
+                row = conn.execute(
+                    "UPDATE blobs SET refcount = refcount + 1 WHERE hash = ? RETURNING filename",
+                    (digest,),
+                ).fetchone()
+            return row[0] if row is not None else None
+
+        return await self._run(acquire)
+
+    async def retain(self, filename: str) -> bool:
+        """Take another reference to a stored file by name and return whether it is tracked"""
+
+        def retain(conn: sqlite3.Connection) -> bool:
+            with conn:
+                row = conn.execute(
+                    "UPDATE blobs SET refcount = refcount + 1 WHERE filename = ? RETURNING refcount",
+                    (filename,),
+                ).fetchone()
+            return row is not None
+
+        return await self._run(retain)
+
+    async def add(self, digest: str, filename: str) -> str:
+        """Record a file that has just been stored and return the filename to hand out
+
+        Entries are only added once their file is in storage, so every filename in the
+        index can be served. If a concurrent upload of the same content was recorded
+        first, a reference to that file is taken instead and its filename is returned,
+        and the caller should delete its own copy.
+        """
+
+        def add(conn: sqlite3.Connection) -> str:
+            with conn:
+                rows = conn.execute(
+                    "INSERT INTO blobs (hash, filename, refcount) VALUES (?, ?, 1) "
+                    "ON CONFLICT (hash) DO UPDATE SET refcount = refcount + 1 "
+                    "RETURNING filename",
+                    (digest, filename),
+                ).fetchall()
+            return rows[0][0]
+
+        return await self._run(add)
+
+    async def release(self, filename: str) -> bool:
+        """Drop one reference to a file and return whether it should be deleted from storage"""
+
+        def release(conn: sqlite3.Connection) -> bool:
+            with conn:
+                rows = conn.execute(
+                    "UPDATE blobs SET refcount = refcount - 1 WHERE filename = ? RETURNING refcount",
+                    (filename,),
+                ).fetchall()
+                if not rows:
+                    # Not tracked, e.g. stored before deduplication was enabled
+                    return True
+                if rows[0][0] > 0:
+                    return False
+                conn.execute("DELETE FROM blobs WHERE filename = ?", (filename,))
+            return True
+
+        return await self._run(release)
+
+    async def forget(self, filename: str) -> None:
+        """Drop the entry for a file that is no longer in storage, whatever its reference count"""
+
+        def forget(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute("DELETE FROM blobs WHERE filename = ?", (filename,))
+
+        await self._run(forget)
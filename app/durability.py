@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import os
+import secrets
+from pathlib import Path
+from typing import TYPE_CHECKING, Literal
+
+if TYPE_CHECKING:
+    from types import TracebackType
+    from typing import Self
+
+type Durability = Literal["none", "fsync", "group"]
+
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def supports_tmpfile(directory: str) -> bool:
+    """Check whether anonymous O_TMPFILE files can be created and linked in a directory"""
+    if not hasattr(os, "O_TMPFILE"):
+        return False
+
+    probe = f"{directory}/.tmpfile-probe-{secrets.token_hex(8)}"
+    try:
+        fd = os.open(directory, os.O_TMPFILE | os.O_WRONLY, 0o644)
+    except OSError:
+        return False
+    try:
+        os.link(f"/proc/self/fd/{fd}", probe)
+    except OSError:
+        return False
+    else:
+        Path(probe).unlink()
+        return True
+    finally:
+        os.close(fd)
+
+
+class GroupCommitter:
+    """Batches fsyncs from concurrent writes into one pass on a worker thread"""
+
+    def __init__(self, window: float = 0.005) -> None:
+        self.window = window
+        self._files: list[tuple[int, asyncio.Future[None]]] = []
+        self._dirs: dict[str, list[asyncio.Future[None]]] = {}
+        self._task: asyncio.Task[None] | None = None
+
+    async def fsync(self, fd: int) -> None:
+        # Sync a duplicate so the writer can close its descriptor whenever it likes
+        future = asyncio.get_running_loop().create_future()
+        self._files.append((os.dup(fd), future))
+        self._schedule()
+        await future
+
+    async def fsync_dir(self, path: str) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._dirs.setdefault(path, []).append(future)
+        self._schedule()
+        await future
+
+    def _schedule(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        await asyncio.sleep(self.window)
+        files, self._files = self._files, []
+        dirs, self._dirs = self._dirs, {}
+        self._task = None
+
+        errors = await asyncio.to_thread(self._sync, [fd for fd, _ in files], list(dirs))
+
+        waiters = [(fd, future) for fd, future in files]
+        waiters += [(path, future) for path, futures in dirs.items() for future in futures]
+        for key, future in waiters:
+            if future.done():
+                continue
+            if key in errors:
+                future.set_exception(errors[key])
+            else:
+                future.set_result(None)
+
+    def _sync(self, fds: list[int], dirs: list[str]) -> dict[int | str, OSError]:
+        errors: dict[int | str, OSError] = {}
+        for fd in fds:
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                errors[fd] = e
+            finally:
+                os.close(fd)
+        for path in dirs:
+            try:
+                _fsync_dir(path)
+            except OSError as e:
+                errors[path] = e
+        return errors
+
+
+class AtomicWriter:
+    """Writes a file that only appears at its final path once it has been fully written"""
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        durability: Durability = "none",
+        committer: GroupCommitter | None = None,
+        use_tmpfile: bool = False,
+    ) -> None:
+        self.path = path
+        self.directory, self.name = path.rsplit("/", 1)
+        self.durability = durability
+        self.committer = committer
+        self.use_tmpfile = use_tmpfile
+        self._fd = -1
+        self._temp_path: str | None = None
+        self._committed = False
+
+    async def __aenter__(self) -> Self:
+        await asyncio.to_thread(self._open)
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        await asyncio.to_thread(self._cleanup)
+
+    def _open(self) -> None:
+        if self.use_tmpfile:
+            # Anonymous file with no name until it is linked in on commit
+            self._fd = os.open(self.directory, os.O_TMPFILE | os.O_WRONLY, 0o644)
+            return
+
+        self._temp_path = f"{self.directory}/.{self.name}.{secrets.token_hex(8)}.tmp"
+        self._fd = os.open(self._temp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+
+    def _write(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+
+    def _publish(self) -> None:
+        if self._temp_path is None:
+            try:
+                os.link(f"/proc/self/fd/{self._fd}", self.path)
+            except FileExistsError:
+                # linkat can't replace, so link under a temporary name and rename over
+                temp_path = f"{self.directory}/.{self.name}.{secrets.token_hex(8)}.tmp"
+                os.link(f"/proc/self/fd/{self._fd}", temp_path)
+                Path(temp_path).replace(self.path)
+        else:
+            Path(self._temp_path).replace(self.path)
+            self._temp_path = None
+
+    def _cleanup(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        if self._temp_path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                Path(self._temp_path).unlink()
+            self._temp_path = None
+
+    async def write(self, data: bytes) -> None:
+        await asyncio.to_thread(self._write, data)
+
+    async def commit(self) -> None:
+        """Make the file durable according to the durability mode and move it into place"""
+        if self._committed:
+            return
+
+        if self.durability == "fsync":
+            await asyncio.to_thread(os.fsync, self._fd)
+        elif self.durability == "group" and self.committer is not None:
+            await self.committer.fsync(self._fd)
+
+        await asyncio.to_thread(self._publish)
+        self._committed = True
+
+        # The rename itself is only durable once the directory is synced
+        if self.durability == "fsync":
+            await asyncio.to_thread(_fsync_dir, self.directory)
+        elif self.durability == "group" and self.committer is not None:
+            await self.committer.fsync_dir(self.directory)
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+import fastapi
+
+from .index import SQLiteStore
+
+if TYPE_CHECKING:
+    import sqlite3
+    from collections.abc import Awaitable, Callable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status_code INTEGER NOT NULL,
+    body BLOB NOT NULL,
+    headers TEXT NOT NULL,
+    created REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idempotency_created ON idempotency (created);
+"""
+
+MAX_KEY_LENGTH = 255
+
+# Recomputed by the response itself on replay
+SKIPPED_HEADERS = {"content-length", "content-type"}
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: int
+    body: bytes
+    headers: dict[str, str]
+
+
+class IdempotencyStore(SQLiteStore):
+    """Remembers upload responses by Idempotency-Key, so retries don't redo the upload"""
+
+    schema = SCHEMA
+
+    def __init__(self, path: str, window: float = 86400) -> None:
+        super().__init__(path)
+        self.window = window
+        self._inflight: dict[str, tuple[str, asyncio.Task[StoredResponse]]] = {}
+
+    async def get(self, key: str) -> StoredResponse | None:
+        def get(conn: sqlite3.Connection) -> StoredResponse | None:
+            row = conn.execute(
+                "SELECT fingerprint, status_code, body, headers FROM idempotency "
+                "WHERE key = ? AND created >= ?",
+                (key, time.time() - self.window),
+            ).fetchone()
+            if row is None:
+                return None
+            fingerprint, status_code, body, headers = row
+            return StoredResponse(fingerprint, status_code, body, json.loads(headers))
+
+        return await self._run(get)
+
+    async def put(self, key: str, response: StoredResponse) -> None:
+        def put(conn: sqlite3.Connection) -> None:
+            with conn:
+                # Expired keys are cleared on the way, so the table only holds the window
+                conn.execute(
+                    "DELETE FROM idempotency WHERE created < ?", (time.time() - self.window,)
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO idempotency "
+                    "(key, fingerprint, status_code, body, headers, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        response.fingerprint,
+                        response.status_code,
+                        response.body,
+                        json.dumps(response.headers),
+                        time.time(),
+                    ),
+                )
+
+        await self._run(put)
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        handler: Callable[[], Awaitable[fastapi.responses.Response]],
+    ) -> fastapi.responses.Response:
+        """Response of the first request made with a key, running the handler only for that one"""
+        if len(key) > MAX_KEY_LENGTH:
+            raise fastapi.HTTPException(status_code=400, detail="Idempotency-Key is too long")
+
+        if key not in self._inflight:
+            stored = await self.get(key)
+            if stored is not None:
+                return self._replay(stored, fingerprint)
+
+        # Concurrent requests with the same key wait on the first one instead of repeating it
+        if key in self._inflight:
+            inflight_fingerprint, task = self._inflight[key]
+            if inflight_fingerprint != fingerprint:
+                raise self._mismatch()
+            return self._replay(await asyncio.shield(task), fingerprint)
+
+        task = asyncio.create_task(self._execute(key, fingerprint, handler))
+        self._inflight[key] = (fingerprint, task)
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        stored = await asyncio.shield(task)
+        return fastapi.responses.Response(
+            stored.body, stored.status_code, stored.headers, media_type="application/json"
+        )
+
+    async def _execute(
+        self,
+        key: str,
+        fingerprint: str,
+        handler: Callable[[], Awaitable[fastapi.responses.Response]],
+    ) -> StoredResponse:
+        # Errors propagate without being stored, so a retry gets another attempt
+        response = await handler()
+        stored = StoredResponse(
+            fingerprint,
+            response.status_code,
+            bytes(response.body),
+            {
+                name: value
+                for name, value in response.headers.items()
+                if name not in SKIPPED_HEADERS
+            },
+        )
+        await self.put(key, stored)
+        return stored
+
+    def _replay(self, stored: StoredResponse, fingerprint: str) -> fastapi.responses.Response:
+        if stored.fingerprint != fingerprint:
+            raise self._mismatch()
+        return fastapi.responses.Response(
+            stored.body,
+            stored.status_code,
+            {**stored.headers, "Idempotent-Replayed": "true"},
+            media_type="application/json",
+        )
+
+    @staticmethod
+    def _mismatch() -> fastapi.HTTPException:
+        return fastapi.HTTPException(
+            status_code=422, detail="Idempotency-Key was already used for a different upload"
+        )
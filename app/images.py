@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import contextlib
+import io
+
+from PIL import Image, ImageCms, ImageOps, ImageSequence, UnidentifiedImageError
+
+from .config import settings
+
+# Modes the PNG encoder can write as-is, everything else is converted first
+PNG_MODES = {"1", "L", "LA", "P", "RGB", "RGBA", "I", "I;16"}
+
+# Pillow format names of the lossy variants, by file extension
+VARIANT_FORMATS = {"webp": "WEBP", "avif": "AVIF"}
+
+# Converted images are written in sRGB, the color space assumed without a profile
+SRGB_PROFILE = ImageCms.createProfile("sRGB")
+
+
+class InvalidImageError(ValueError):
+    """The uploaded bytes are not an image that can be decoded"""
+
+
+def _check_pixels(image: Image.Image) -> None:
+    pixels = image.width * image.height
+    if pixels > settings.image_max_pixels:
+        msg = f"Image size ({pixels} pixels) exceeds limit of {settings.image_max_pixels} pixels"
+        raise InvalidImageError(msg)
+
+
+def _open(data: bytes) -> Image.Image:
+    # Pillow only errors at twice this size, but it stays as a backstop for later frames
+    Image.MAX_IMAGE_PIXELS = settings.image_max_pixels
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Opening only reads the header, so decompression bombs are refused before decoding
+        _check_pixels(image)
+        image.load()
+    except InvalidImageError:
+        raise
+    except UnidentifiedImageError as e:
+        msg = "Unrecognized image format"
+        raise InvalidImageError(msg) from e
+    except Image.DecompressionBombError as e:
+        raise InvalidImageError(str(e)) from e
+    except (OSError, SyntaxError, ValueError) as e:
+        msg = f"Could not decode image: {e}"
+        raise InvalidImageError(msg) from e
+    return image
+
+
+def _convert(image: Image.Image, mode: str) -> Image.Image:
+    """Convert an image to an RGB mode, mapping its colors through its ICC profile to sRGB
+
+    The profile describes the original pixels, not the converted ones, so it is dropped
+    even when it can't be applied.
+    """
+    if image.mode == mode:
+        return image
+
+    converted = None
+    icc_profile = image.info.get("icc_profile")
+    if icc_profile:
+        with contextlib.suppress(ImageCms.PyCMSError, OSError):
+            converted = ImageCms.profileToProfile(
+                image,
+                ImageCms.ImageCmsProfile(io.BytesIO(icc_profile)),
+                SRGB_PROFILE,
+                outputMode=mode,
+            )
+    if converted is None:
+        converted = image.convert(mode)
+    converted.info.pop("icc_profile", None)
+    return converted
+
+
+def _normalize(image: Image.Image) -> Image.Image:
+    # Metadata is dropped, so bake the EXIF orientation into the pixels first
+    image = ImageOps.exif_transpose(image)
+    if image.mode == "RGBA" and image.getchannel("A").getextrema() == (255, 255):
+        # A fully opaque alpha channel only costs space
+        return image.convert("RGB")
+    if image.mode in PNG_MODES:
+        return image
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    return _convert(image, "RGBA" if has_alpha else "RGB")
+
+
+def to_variant(data: bytes, extension: str, quality: int) -> bytes:
+    """Encode an already converted image in a smaller lossy format such as WebP or AVIF"""
+    image = _open(data)
+    animated = getattr(image, "n_frames", 1) > 1
+
+    output = io.BytesIO()
+    image.save(
+        output,
+        VARIANT_FORMATS[extension],
+        save_all=animated,
+        quality=quality,
+        icc_profile=image.info.get("icc_profile"),
+    )
+    return output.getvalue()
+
+
+def resize(data: bytes, width: int | None, height: int | None, fit: str) -> bytes:
+    """Scale an image down to fit, cover or fill the given box and encode it as PNG
+
+    A missing dimension is derived from the aspect ratio. Images are never enlarged,
+    and only the first frame of an animation is used.
+    """
+    image = _open(data)
+    if width is None:
+        width = max(1, round(image.width * (height or image.height) / image.height))
+    if height is None:
+        height = max(1, round(image.height * width / image.width))
+    if image.mode in {"1", "P"}:
+        # Palette images can only be resized with nearest neighbour sampling
+        image = image.convert("RGBA")
+
+    if fit == "contain":
+        image.thumbnail((width, height))
+    else:
+        # Shrink the box rather than enlarge the image to cover or fill it
+        scale = min(1, image.width / width, image.height / height)
+        box = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image = ImageOps.fit(image, box) if fit == "cover" else image.resize(box)
+
+    output = io.BytesIO()
+    image.save(output, "PNG", icc_profile=image.info.get("icc_profile"))
+    return output.getvalue()
+
+
+def to_png(data: bytes) -> bytes:
+    """Decode an image and re-encode it as a size-optimized PNG without metadata
+
+    Only the ICC profile is kept, since dropping it would change how colors render,
+    unless the image had to be converted to sRGB. Animated images are written as
+    animated PNGs.
+    """
+    image = _open(data)
+    animated = getattr(image, "n_frames", 1) > 1
+
+    output = io.BytesIO()
+    if animated:
+        # Frames can each have their own palette, so they are all stored as RGBA
+        frames = [
+            _convert(ImageOps.exif_transpose(frame), "RGBA")
+            for frame in ImageSequence.Iterator(image)
+        ]
+        frames[0].save(
+            output,
+            "PNG",
+            save_all=True,
+            append_images=frames[1:],
+            duration=image.info.get("duration", 100),
+            loop=image.info.get("loop", 0),
+            optimize=True,
+            icc_profile=frames[0].info.get("icc_profile"),
+        )
+    else:
+        image = _normalize(image)
+        # optimize makes zlib use its highest compression level
+        image.save(output, "PNG", optimize=True, icc_profile=image.info.get("icc_profile"))
+    return output.getvalue()
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncGenerator, Callable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    content_type TEXT,
+    hash TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    count INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals (id, count, size) VALUES (0, 0, 0);
+
+CREATE TRIGGER IF NOT EXISTS files_insert AFTER INSERT ON files BEGIN
+    UPDATE totals SET count = count + 1, size = size + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS files_delete AFTER DELETE ON files BEGIN
+    UPDATE totals SET count = count - 1, size = size - OLD.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS files_update AFTER UPDATE OF size ON files BEGIN
+    UPDATE totals SET size = size - OLD.size + NEW.size WHERE id = 0;
+END;
+"""
+
+UPSERT = """
+INSERT INTO files (filename, size, mtime, content_type, hash) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (filename) DO UPDATE SET
+    size = excluded.size,
+    mtime = excluded.mtime,
+    content_type = excluded.content_type,
+    hash = excluded.hash
+"""
+
+
+class FileRecord(NamedTuple):
+    filename: str
+    size: int
+    mtime: float
+    content_type: str | None = None
+    hash: str | None = None
+
+
+class SQLiteStore:
+    """Base for small SQLite databases accessed from the event loop"""
+
+    schema = ""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        # A single worker thread serializes every access to the connection
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(self).__name__)
+
+    async def _run[T](self, func: Callable[[sqlite3.Connection], T]) -> T:
+        if self._conn is None:
+            msg = f"{type(self).__name__} has not been started"
+            raise RuntimeError(msg)
+
+        conn = self._conn
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, conn)
+
+    async def start(self) -> None:
+        """Open the database and create the schema if needed"""
+        if self._conn is not None:
+            return
+
+        def connect() -> sqlite3.Connection:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.schema)
+            return conn
+
+        loop = asyncio.get_running_loop()
+        self._conn = await loop.run_in_executor(self._executor, connect)
+
+    async def close(self) -> None:
+        if self._conn is None:
+            return
+        await self._run(sqlite3.Connection.close)
+        self._conn = None
+
+
+class FileIndex(SQLiteStore):
+    """SQLite-backed index of stored files, so listings and totals don't need a storage scan"""
+
+    schema = SCHEMA
+
+    async def add(self, record: FileRecord) -> None:
+        def add(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute(UPSERT, record)
+
+        await self._run(add)
+
+    async def remove(self, filename: str) -> None:
+        def remove(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute("DELETE FROM files WHERE filename = ?", (filename,))
+
+        await self._run(remove)
+
+    async def count(self) -> int:
+        def count(conn: sqlite3.Connection) -> int:
+            return conn.execute("SELECT count FROM totals WHERE id = 0").fetchone()[0]
+
+        return await self._run(count)
+
+    async def total_size(self) -> int:
+        def total_size(conn: sqlite3.Connection) -> int:
+            return conn.execute("SELECT size FROM totals WHERE id = 0").fetchone()[0]
+
+        return await self._run(total_size)
+
+    async def totals(self) -> tuple[int, int]:
+        """File count and total size, read together"""
+
+        def totals(conn: sqlite3.Connection) -> tuple[int, int]:
+            return conn.execute("SELECT count, size FROM totals WHERE id = 0").fetchone()
+
+        return await self._run(totals)
+
+    async def list_files(self) -> dict[str, int]:
+        def list_files(conn: sqlite3.Connection) -> dict[str, int]:
+            return dict(conn.execute("SELECT filename, size FROM files ORDER BY filename"))
+
+        return await self._run(list_files)
+
+    async def iter_files(
+        self, after: str | None = None, batch_size: int = 1000
+    ) -> AsyncGenerator[tuple[str, int]]:
+        """Yield (filename, size) in filename order, reading one batch at a time"""
+        cursor = after or ""
+        while True:
+
+            def page(conn: sqlite3.Connection, cursor: str = cursor) -> list[tuple[str, int]]:
+                return conn.execute(
+                    "SELECT filename, size FROM files WHERE filename > ? ORDER BY filename LIMIT ?",
+                    (cursor, batch_size),
+                ).fetchall()
+
+            rows = await self._run(page)
+            for row in rows:
+                yield row
+            if len(rows) < batch_size:
+                return
+            cursor = rows[-1][0]
+
+    async def reconcile(self, records: list[FileRecord]) -> None:
+        """Bring the index in line with what is actually in storage
+
+        Files that changed or appeared out of band are (re)indexed without a hash,
+        and entries for files that no longer exist are dropped.
+        """
+
+        def reconcile(conn: sqlite3.Connection) -> None:
+            indexed = {
+                filename: (size, mtime)
+                for filename, size, mtime in conn.execute("SELECT filename, size, mtime FROM files")
+            }
+            changed = [
+                record
+                for record in records
+                if indexed.pop(record.filename, None) != (record.size, record.mtime)
+            ]
+            with conn:
+                conn.executemany(UPSERT, changed)
+                conn.executemany(
+                    "DELETE FROM files WHERE filename = ?", [(name,) for name in indexed]
+                )
+
+        await self._run(reconcile)
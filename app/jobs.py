@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import secrets
+import time
+from typing import TYPE_CHECKING, Literal, NamedTuple
+
+import fastapi
+
+from .index import SQLiteStore
+
+if TYPE_CHECKING:
+    import sqlite3
+    from collections.abc import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+type JobStatus = Literal["queued", "running", "done", "failed"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL,
+    filename TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+
+class Job(NamedTuple):
+    id: str
+    source: str
+    status: JobStatus
+    filename: str | None
+    error: str | None
+    created: float
+    updated: float
+
+
+class JobStore(SQLiteStore):
+    """SQLite-backed record of upload jobs, so queued work survives a restart"""
+
+    schema = SCHEMA
+
+    async def add(self, job_id: str, source: str) -> None:
+        def add(conn: sqlite3.Connection) -> None:
+            now = time.time()
+            with conn:
+                conn.execute(
+                    "INSERT INTO jobs (id, source, status, created, updated) "
+                    "VALUES (?, ?, 'queued', ?, ?)",
+                    (job_id, source, now, now),
+                )
+
+        await self._run(add)
+
+    async def get(self, job_id: str) -> Job | None:
+        def get(conn: sqlite3.Connection) -> Job | None:
+            row = conn.execute(
+                "SELECT id, source, status, filename, error, created, updated FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            return None if row is None else Job(*row)
+
+        return await self._run(get)
+
+    async def update(
+        self,
+        job_id: str,
+        status: JobStatus,
+        *,
+        filename: str | None = None,
+        error: str | None = None,
+    ) -> None:
+        def update(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, filename = ?, error = ?, updated = ? WHERE id = ?",
+                    (status, filename, error, time.time(), job_id),
+                )
+
+        await self._run(update)
+
+    async def pending(self) -> list[tuple[str, str]]:
+        """Jobs that were queued or interrupted while running, oldest first"""
+
+        def pending(conn: sqlite3.Connection) -> list[tuple[str, str]]:
+            return conn.execute(
+                "SELECT id, source FROM jobs WHERE status IN ('queued', 'running') ORDER BY created"
+            ).fetchall()
+
+        return await self._run(pending)
+
+    async def prune(self, before: float) -> int:
+        """Delete finished jobs last updated before the given time"""
+
+        def prune(conn: sqlite3.Connection) -> int:
+            with conn:
+                return conn.execute(
+                    "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (before,)
+                ).rowcount
+
+        return await self._run(prune)
+
+
+class UploadJobQueue:
+    """Runs uploads in the background on a bounded number of workers"""
+
+    def __init__(
+        self,
+        store: JobStore,
+        process: Callable[[str], Awaitable[str]],
+        *,
+        workers: int = 4,
+        retention: float = 86400,
+    ) -> None:
+        self.store = store
+        self.process = process
+        self.workers = workers
+        self.retention = retention
+        self._queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue()
+        self._tasks: list[asyncio.Task[None]] = []
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+
+        await self.store.start()
+        # Jobs interrupted by the last shutdown are picked up again from the start
+        for job in await self.store.pending():
+            self._queue.put_nowait(job)
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.retention > 0:
+            self._tasks.append(asyncio.create_task(self._prune_loop()))
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+        await self.store.close()
+
+    async def submit(self, source: str) -> str:
+        job_id = secrets.token_urlsafe(16)
+        await self.store.add(job_id, source)
+        self._queue.put_nowait((job_id, source))
+        return job_id
+
+    async def get(self, job_id: str) -> Job | None:
+        return await self.store.get(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id, source = await self._queue.get()
+            try:
+                await self._run_job(job_id, source)
+            except Exception:
+                # Keep the worker alive if the job's status couldn't be recorded
+                logger.exception("Failed to record upload job %s", job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: str, source: str) -> None:
+        await self.store.update(job_id, "running")
+        try:
+            filename = await self.process(source)
+        except fastapi.HTTPException as e:
+            await self.store.update(job_id, "failed", error=str(e.detail))
+        except Exception as e:
+            logger.exception("Upload job %s failed", job_id)
+            await self.store.update(job_id, "failed", error=str(e) or type(e).__name__)
+        else:
+            await self.store.update(job_id, "done", filename=filename)
+
+    async def _prune_loop(self) -> None:
+        while True:
+            try:
+                await self.store.prune(time.time() - self.retention)
+            except Exception:
+                logger.exception("Failed to prune finished upload jobs")
+            await asyncio.sleep(min(self.retention, 3600))
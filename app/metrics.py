@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import time
+from typing import Any
+
+from .config import settings
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up, i.e. how long it was blocked"""
+
+    def __init__(self, interval: float = 0.1) -> None:
+        self.interval = interval
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - start - self.interval, 0.0)
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "samples": self.samples,
+            "mean_lag_seconds": self.total_lag / self.samples if self.samples else 0.0,
+            "max_lag_seconds": self.max_lag,
+            "total_lag_seconds": self.total_lag,
+        }
+
+
+# Create a global event loop monitor instance
+loop_monitor = LoopLagMonitor(settings.loop_monitor_interval)
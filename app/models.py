@@ -1,7 +1,52 @@
 from __future__ import annotations
 
-from pydantic import BaseModel
+import re
+from typing import Literal
+
+import pydantic
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field
+
+# The shape nearly every /upload body has: a single source string without escapes
+_SOURCE_PREFIX = re.compile(rb'\s*\{\s*"source"\s*:\s*"')
+_SOURCE_SUFFIX = re.compile(rb'"\s*\}\s*')
 
 
 class UploadFileData(BaseModel):
     source: str  # URL or base64-encoded data
+
+
+class PresignUploadData(BaseModel):
+    method: Literal["put", "post"] = "put"
+    size: int | None = Field(default=None, gt=0)  # Required for PUT, which is signed for it
+
+
+class CompleteUploadData(BaseModel):
+    filename: str
+
+
+def parse_upload_body(body: bytes | bytearray) -> memoryview:
+    """The source of an /upload body as a view into the body, without copying it
+
+    Bodies that aren't a lone, escape-free source string are parsed as UploadFileData.
+    """
+    prefix = _SOURCE_PREFIX.match(body)
+    if prefix is not None:
+        start = prefix.end()
+        end = body.find(b'"', start)
+        if (
+            end != -1
+            and body.find(b"\\", start, end) == -1
+            and _SOURCE_SUFFIX.fullmatch(body, end) is not None
+        ):
+            return memoryview(body)[start:end]
+
+    try:
+        data = UploadFileData.model_validate_json(body)
+    except pydantic.ValidationError as e:
+        # Laid out like FastAPI's own body errors, minus the raw body as input
+        errors = e.errors(include_url=False, include_input=False)
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in errors]
+        ) from e
+    return memoryview(data.source.encode())
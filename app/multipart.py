@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Any
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+if TYPE_CHECKING:
+    from types import TracebackType
+    from typing import Self
+
+logger = logging.getLogger(__name__)
+
+# Delay before the first retry of a failed part, doubled on every further attempt
+RETRY_BACKOFF = 0.2
+
+
+class MultipartWriter:
+    """Streams an object to S3 as a multipart upload, which is aborted unless committed
+
+    Parts are uploaded concurrently while the next one is being filled, and at most
+    `concurrency` parts are held in memory at a time. A failed part is retried on its
+    own instead of restarting the whole upload.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        s3: Any,
+        bucket: str,
+        key: str,
+        *,
+        content_type: str,
+        part_size: int = 8 * 1024 * 1024,
+        concurrency: int = 4,
+        retries: int = 3,
+    ) -> None:
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self.retries = retries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._buffer = bytearray()
+        self._tasks: list[asyncio.Task[dict[str, Any]]] = []
+        self._upload_id: str | None = None
+        self._committed = False
+
+    async def __aenter__(self) -> Self:
+        response = await self.s3.create_multipart_upload(
+            Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+        )
+        self._upload_id = response["UploadId"]
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if self._committed or self._upload_id is None:
+            return
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        try:
+            await self.s3.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id
+            )
+        except (BotoCoreError, ClientError):
+            # The parts linger until a bucket lifecycle rule cleans them up
+            logger.warning("Failed to abort multipart upload of %s", self.key, exc_info=True)
+
+    async def write(self, data: bytes | bytearray) -> None:
+        # Every part but the last has to be the same size, so data is cut at part boundaries
+        view = memoryview(data)
+        if self._buffer:
+            take = min(len(view), self.part_size - len(self._buffer))
+            self._buffer += view[:take]
+            view = view[take:]
+            if len(self._buffer) == self.part_size:
+                await self._submit(bytes(self._buffer))
+                self._buffer.clear()
+
+        while len(view) >= self.part_size:
+            await self._submit(bytes(view[: self.part_size]))
+            view = view[self.part_size :]
+        self._buffer += view
+
+    async def commit(self) -> None:
+        """Upload what's left and assemble the parts into the final object"""
+        if self._committed:
+            return
+
+        if self._buffer or not self._tasks:
+            await self._submit(bytes(self._buffer))
+            self._buffer.clear()
+
+        parts = await asyncio.gather(*self._tasks)
+        await self.s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+        self._committed = True
+
+    async def _submit(self, body: bytes) -> None:
+        # Waiting for a free slot is what keeps memory bounded when S3 is slower than the source
+        await self._semaphore.acquire()
+        for task in self._tasks:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                self._semaphore.release()
+                # Fail fast instead of uploading parts of an object that can't be completed
+                task.result()
+
+        task = asyncio.create_task(self._upload_part(len(self._tasks) + 1, body))
+        task.add_done_callback(lambda _: self._semaphore.release())
+        self._tasks.append(task)
+
+    async def _upload_part(self, number: int, body: bytes) -> dict[str, Any]:
+        attempt = 0
+        while True:
+            try:
+                response = await self.s3.upload_part(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self._upload_id,
+                    PartNumber=number,
+                    Body=body,
+                )
+            except (BotoCoreError, ClientError):
+                if attempt >= self.retries:
+                    raise
+                logger.warning("Retrying part %d of %s", number, self.key, exc_info=True)
+                await asyncio.sleep(RETRY_BACKOFF * 2**attempt)
+                attempt += 1
+            else:
+                return {"ETag": response["ETag"], "PartNumber": number}
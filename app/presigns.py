@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING
+
+from .index import SQLiteStore
+
+if TYPE_CHECKING:
+    import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS presigned (
+    filename TEXT PRIMARY KEY,
+    expires REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS presigned_expires ON presigned (expires);
+"""
+
+
+class PresignStore(SQLiteStore):
+    """Filenames handed out for direct uploads that haven't been completed yet
+
+    Kept on disk, so uploads started before a restart can still be completed after it.
+    """
+
+    schema = SCHEMA
+
+    async def add(self, filename: str, expires: float) -> None:
+        def add(conn: sqlite3.Connection) -> None:
+            with conn:
+                # Abandoned uploads are cleared on the way, so the table stays small
+                conn.execute("DELETE FROM presigned WHERE expires < ?", (time.time(),))
+                conn.execute(
+                    "INSERT OR REPLACE INTO presigned (filename, expires) VALUES (?, ?)",
+                    (filename, expires),
+                )
+
+        await self._run(add)
+
+    async def pending(self, filename: str) -> bool:
+        def pending(conn: sqlite3.Connection) -> bool:
+            row = conn.execute(
+                "SELECT 1 FROM presigned WHERE filename = ? AND expires >= ?",
+                (filename, time.time()),
+            ).fetchone()
+            return row is not None
+
+        return await self._run(pending)
+
+    async def complete(self, filename: str) -> bool:
+        """Remove a pending upload and return whether it was still pending"""
+
+        def complete(conn: sqlite3.Connection) -> bool:
+            with conn:
+                rows = conn.execute(
+                    "DELETE FROM presigned WHERE filename = ? AND expires >= ? RETURNING filename",
+                    (filename, time.time()),
+                ).fetchall()
+            return bool(rows)
+
+        return await self._run(complete)
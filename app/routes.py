@@ -1,18 +1,41 @@
 from __future__ import annotations
 
-import base64
+import asyncio
+import binascii
+import contextlib
+import hashlib
 import random
 import string
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Literal
 
-import aiohttp
+import aiofiles.os
 import fastapi
 
+from .admission import upload_admission
 from .config import settings
-from .storage import LocalStorageProvider, StorageProvider
+from .images import InvalidImageError
+from .metrics import loop_monitor
+from .sources import normalize_url
+from .storage import LocalStorageProvider, S3StorageProvider, StorageProvider
+from .streaming import (
+    check_content_length,
+    encode_json_object,
+    encode_ndjson,
+    iter_multipart_file,
+    limit_size,
+)
+from .thumbnails import thumbnail_cache
+from .variants import accepted_variants, variant_generator
+from .workers import cpu_pool
 
 if TYPE_CHECKING:
-    from .models import UploadFileData
+    from collections.abc import AsyncIterator
+
+    import aiohttp
+
+    from .jobs import UploadJobQueue
+    from .models import CompleteUploadData, PresignUploadData
+    from .sources import SourceCache
 
 
 def index() -> fastapi.responses.RedirectResponse:
@@ -31,36 +54,293 @@ def health_check() -> fastapi.responses.JSONResponse:
     return fastapi.responses.JSONResponse(content={"status": "ok"})
 
 
+def metrics() -> fastapi.responses.JSONResponse:
+    return fastapi.responses.JSONResponse(
+        content={
+            "event_loop": loop_monitor.metrics(),
+            "cpu_pool": cpu_pool.metrics(),
+            "uploads": upload_admission.metrics(),
+            "variants": variant_generator.metrics(),
+        }
+    )
+
+
+def generate_filename() -> str:
+    return "".join(random.choices(string.ascii_letters, k=16)) + ".png"
+
+
+async def transcode(content: bytes) -> bytes:
+    """Re-encode an upload as an optimized PNG on the CPU pool, if enabled"""
+    if not settings.image_transcode_enabled:
+        return content
+    try:
+        return await cpu_pool.to_png(content)
+    except InvalidImageError as e:
+        raise fastapi.HTTPException(status_code=400, detail=f"Invalid image: {e}") from e
+
+
+async def save_content(content: bytes, storage: StorageProvider) -> str:
+    """Store an upload under a random filename and start generating its variants"""
+    generated = generate_filename()
+    filename = await storage.save_file(generated, content)
+    # A different filename means identical content is already stored, variants included
+    if filename == generated:
+        variant_generator.schedule(storage, filename, content)
+    return filename
+
+
+async def save_chunks(chunks: AsyncIterator[bytes], storage: StorageProvider) -> str:
+    """Store a streamed upload, enforcing the size limit as it arrives"""
+    chunks = limit_size(chunks)
+    if not settings.image_transcode_enabled:
+        # Nothing to decode, so stream straight into storage without buffering
+        return await storage.save_stream(generate_filename(), chunks)
+
+    content = await transcode(b"".join([chunk async for chunk in chunks]))
+    return await save_content(content, storage)
+
+
+async def save_url(
+    source: str,
+    storage: StorageProvider,
+    session: aiohttp.ClientSession,
+    sources: SourceCache | None = None,
+) -> str:
+    if sources is None:
+        async with session.get(source) as response:
+            response.raise_for_status()
+            check_content_length(response.content_length)
+
+            return await save_chunks(
+                response.content.iter_chunked(settings.upload_chunk_size), storage
+            )
+
+    url = normalize_url(source)
+    record = await sources.get(url)
+    if record is not None and sources.is_fresh(record):
+        if await storage.reuse(record.filename):
+            return record.filename
+        # The stored copy was deleted, so download the source again
+        record = None
+
+    # Past the TTL, ask the source whether the copy we have is still current
+    headers: dict[str, str] = {}
+    if record is not None:
+        if record.etag:
+            headers["If-None-Match"] = record.etag
+        if record.last_modified:
+            headers["If-Modified-Since"] = record.last_modified
+
+    async with session.get(source, headers=headers) as response:
+        if record is not None and response.status == 304:
+            if await storage.reuse(record.filename):
+                await sources.touch(url)
+                return record.filename
+        else:
+            response.raise_for_status()
+            check_content_length(response.content_length)
+
+            filename = await save_chunks(
+                response.content.iter_chunked(settings.upload_chunk_size), storage
+            )
+            await sources.put(
+                url, filename, response.headers.get("ETag"), response.headers.get("Last-Modified")
+            )
+            return filename
+
+    # The source is unchanged but the stored copy was deleted, and a 304 has no body
+    # to store, so fetch it again in full
+    await sources.forget(record.filename)
+    return await save_url(source, storage, session, sources)
+
+
+async def upload_fingerprint(source: memoryview) -> str:
+    """Hash identifying an upload request, to tell retries from reused idempotency keys"""
+    # Hashing a large base64 payload would block the event loop
+    return await asyncio.to_thread(lambda: hashlib.sha256(source).hexdigest())
+
+
 async def upload_file(
-    data: UploadFileData, storage: StorageProvider
+    source: memoryview,
+    storage: StorageProvider,
+    session: aiohttp.ClientSession,
+    jobs: UploadJobQueue | None = None,
+    sources: SourceCache | None = None,
 ) -> fastapi.responses.JSONResponse:
     if not settings.uploads_enabled:
         raise fastapi.HTTPException(status_code=503, detail="Uploads are temporarily disabled")
 
-    # Determine if the source is a URL or base64-encoded data
-    if data.source.startswith("http"):
-        async with aiohttp.ClientSession() as session, session.get(data.source) as response:
-            response.raise_for_status()
-            content = await response.read()
-    else:
-        content = base64.b64decode(data.source)
+    if source[:4].tobytes() == b"http":
+        try:
+            url = str(source, "utf-8")
+        except UnicodeDecodeError as e:
+            raise fastapi.HTTPException(status_code=400, detail="Invalid source URL") from e
+
+        if sources is not None:
+            # A URL uploaded recently is answered straight away, without queueing a job
+            record = await sources.get(normalize_url(url))
+            if (
+                record is not None
+                and sources.is_fresh(record)
+                and await storage.reuse(record.filename)
+            ):
+                return fastapi.responses.JSONResponse(content={"filename": record.filename})
+
+        if jobs is not None:
+            # Hand the download to a background worker instead of holding the request open
+            job_id = await jobs.submit(url)
+            return fastapi.responses.JSONResponse(
+                status_code=202,
+                content={"job_id": job_id, "status": "queued"},
+                headers={"Location": f"/jobs/{job_id}"},
+            )
+
+        filename = await save_url(url, storage, session, sources)
+        return fastapi.responses.JSONResponse(content={"filename": filename})
+
+    # Decoding large payloads would block every other request, so it runs on the pool
+    try:
+        content = await cpu_pool.b64decode(source)
+    except binascii.Error as e:
+        raise fastapi.HTTPException(status_code=400, detail=f"Invalid base64 data: {e}") from e
 
     # Check file size
     if len(content) > settings.filesize_limit:
         raise fastapi.HTTPException(status_code=413, detail="File size exceeds limit")
 
-    # Generate random filename
-    filename = "".join(random.choices(string.ascii_letters, k=16)) + ".png"
+    content = await transcode(content)
 
-    # Save the file using storage provider
-    await storage.save_file(filename, content)
+    # Save the file under a random filename, or get back the existing one for duplicates
+    filename = await save_content(content, storage)
 
     return fastapi.responses.JSONResponse(content={"filename": filename})
 
 
-async def list_files(storage: StorageProvider) -> fastapi.responses.JSONResponse:
-    file_sizes = await storage.list_files()
-    return fastapi.responses.JSONResponse(content=file_sizes)
+async def upload_stream(
+    request: fastapi.Request, storage: StorageProvider
+) -> fastapi.responses.JSONResponse:
+    if not settings.uploads_enabled:
+        raise fastapi.HTTPException(status_code=503, detail="Uploads are temporarily disabled")
+
+    # Reject up front when the client already told us the body is too large
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        check_content_length(int(content_length))
+
+    content_type = request.headers.get("content-type", "")
+    chunks: AsyncIterator[bytes]
+    if content_type.startswith("multipart/form-data"):
+        chunks = iter_multipart_file(request)
+    elif content_type.startswith("application/octet-stream"):
+        chunks = request.stream()
+    else:
+        raise fastapi.HTTPException(
+            status_code=415,
+            detail="Content type must be multipart/form-data or application/octet-stream",
+        )
+
+    filename = await save_chunks(chunks, storage)
+
+    return fastapi.responses.JSONResponse(content={"filename": filename})
+
+
+async def presign_upload(
+    data: PresignUploadData, storage: StorageProvider
+) -> fastapi.responses.JSONResponse:
+    if not settings.uploads_enabled:
+        raise fastapi.HTTPException(status_code=503, detail="Uploads are temporarily disabled")
+    if not isinstance(storage, S3StorageProvider):
+        raise fastapi.HTTPException(status_code=501, detail="Direct uploads require S3 storage")
+    if data.method == "put" and data.size is None:
+        raise fastapi.HTTPException(status_code=400, detail="size is required for PUT uploads")
+
+    check_content_length(data.size)
+
+    filename = generate_filename()
+    upload = await storage.presign_upload(
+        filename,
+        method=data.method,
+        size=data.size or settings.filesize_limit,
+        max_size=settings.filesize_limit,
+    )
+    return fastapi.responses.JSONResponse(
+        content={
+            "filename": filename,
+            "method": data.method,
+            "expires_in": storage.presign_expiry,
+            **upload,
+        }
+    )
+
+
+async def complete_upload(
+    data: CompleteUploadData, storage: StorageProvider
+) -> fastapi.responses.JSONResponse:
+    if not isinstance(storage, S3StorageProvider):
+        raise fastapi.HTTPException(status_code=501, detail="Direct uploads require S3 storage")
+
+    await storage.complete_upload(data.filename, settings.filesize_limit)
+    return fastapi.responses.JSONResponse(content={"filename": data.filename})
+
+
+async def _iter_page(page: list[tuple[str, int]]) -> AsyncIterator[tuple[str, int]]:  # noqa: RUF029
+    for item in page:
+        yield item
+
+
+async def _chain(
+    first: tuple[str, int], rest: AsyncIterator[tuple[str, int]]
+) -> AsyncIterator[tuple[str, int]]:
+    yield first
+    async for item in rest:
+        yield item
+
+
+async def _started(items: AsyncIterator[tuple[str, int]]) -> AsyncIterator[tuple[str, int]]:
+    """Read the first entry before the response starts, so a failing listing gets an error
+    status instead of a truncated 200
+    """
+    try:
+        first = await anext(items)
+    except StopAsyncIteration:
+        return _iter_page([])
+    return _chain(first, items)
+
+
+async def list_files(
+    storage: StorageProvider,
+    *,
+    limit: int | None = None,
+    cursor: str | None = None,
+    output: Literal["json", "ndjson"] = "json",
+) -> fastapi.responses.StreamingResponse:
+    items: AsyncIterator[tuple[str, int]]
+    headers: dict[str, str] = {}
+
+    if limit is None:
+        # A full listing needs no order, which lets unindexed local storage stream it
+        items = await _started(storage.iter_files(after=cursor, ordered=cursor is not None))
+    else:
+        # Read one extra entry to find out whether there is another page
+        page: list[tuple[str, int]] = []
+        async with contextlib.aclosing(storage.iter_files(after=cursor)) as files:
+            async for item in files:
+                page.append(item)
+                if len(page) > limit:
+                    break
+
+        if len(page) > limit:
+            page = page[:limit]
+            headers["X-Next-Cursor"] = page[-1][0]
+        items = _iter_page(page)
+
+    if output == "ndjson":
+        return fastapi.responses.StreamingResponse(
+            encode_ndjson(items), media_type="application/x-ndjson", headers=headers
+        )
+    return fastapi.responses.StreamingResponse(
+        encode_json_object(items), media_type="application/json", headers=headers
+    )
 
 
 async def count_files(storage: StorageProvider) -> fastapi.responses.JSONResponse:
@@ -73,20 +353,86 @@ async def total_size(storage: StorageProvider) -> fastapi.responses.JSONResponse
     return fastapi.responses.JSONResponse(content={"total_size": total})
 
 
-async def delete_file(filename: str, storage: StorageProvider) -> fastapi.responses.JSONResponse:
+async def get_job(job_id: str, jobs: UploadJobQueue | None) -> fastapi.responses.JSONResponse:
+    job = await jobs.get(job_id) if jobs is not None else None
+    if job is None:
+        raise fastapi.HTTPException(status_code=404, detail="Job not found")
+
+    return fastapi.responses.JSONResponse(
+        content={
+            "job_id": job.id,
+            "status": job.status,
+            "filename": job.filename,
+            "error": job.error,
+        }
+    )
+
+
+async def delete_file(
+    filename: str, storage: StorageProvider, sources: SourceCache | None = None
+) -> fastapi.responses.JSONResponse:
+    await variant_generator.cancel(filename)
     await storage.delete_file(filename)
+    await thumbnail_cache.discard(filename)
+    if sources is not None:
+        await sources.forget(filename)
     return fastapi.responses.JSONResponse(content={"message": "File deleted"})
 
 
-async def get_file(filename: str, storage: StorageProvider) -> Any:
+async def get_thumbnail(
+    filename: str,
+    storage: StorageProvider,
+    *,
+    width: int | None,
+    height: int | None,
+    fit: Literal["contain", "cover", "fill"],
+) -> fastapi.responses.FileResponse:
+    # Only a fixed set of sizes is allowed, so the cache can't be flooded with variations
+    for size in (width, height):
+        if size is not None and size not in settings.resize_sizes:
+            allowed = ", ".join(map(str, settings.resize_sizes))
+            raise fastapi.HTTPException(status_code=400, detail=f"Size must be one of: {allowed}")
+    if filename.startswith("."):
+        raise fastapi.HTTPException(status_code=404, detail="File not found")
+
+    try:
+        path = await thumbnail_cache.get(storage, filename, width, height, fit)
+    except InvalidImageError as e:
+        raise fastapi.HTTPException(status_code=422, detail=f"Cannot resize file: {e}") from e
+    return fastapi.responses.FileResponse(path)
+
+
+async def get_file(  # noqa: PLR0913
+    filename: str,
+    storage: StorageProvider,
+    *,
+    accept: str | None = None,
+    width: int | None = None,
+    height: int | None = None,
+    fit: Literal["contain", "cover", "fill"] = "contain",
+) -> Any:
+    if width is not None or height is not None:
+        return await get_thumbnail(filename, storage, width=width, height=height, fit=fit)
+
+    # Serve the smallest variant the client accepts, falling back to the original
+    variant_url = None
+    for extension in accepted_variants(accept):
+        variant_url = await storage.get_variant_url(filename, extension)
+        if variant_url is not None:
+            break
+    # Caches must key on Accept when it decides which representation is served
+    headers = {"Vary": "Accept"} if settings.image_variants else None
+
     if isinstance(storage, LocalStorageProvider):
         # For local storage, serve the file directly
         try:
-            file_path = await storage.get_file_url(filename)
-            return fastapi.responses.FileResponse(file_path)
+            file_path = variant_url or await storage.get_file_url(filename)
+            # FileResponse only stats the file once it starts sending, too late for a 404
+            stat = await aiofiles.os.stat(file_path)
+            return fastapi.responses.FileResponse(file_path, headers=headers, stat_result=stat)
         except FileNotFoundError as e:
             raise fastapi.HTTPException(status_code=404, detail="File not found") from e
     else:
         # For S3 storage, redirect to the public URL
-        file_url = await storage.get_file_url(filename)
-        return fastapi.responses.RedirectResponse(url=file_url, status_code=302)
+        file_url = variant_url or await storage.get_file_url(filename)
+        return fastapi.responses.RedirectResponse(url=file_url, status_code=302, headers=headers)
@@ -4,6 +4,7 @@ from typing import Annotated
 
 import fastapi
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from fastapi.security.utils import get_authorization_scheme_param
 
 from .config import settings
 
@@ -22,3 +23,9 @@ def verify_api_key(
             headers={"WWW-Authenticate": "Bearer"},
         )
     return credentials.credentials
+
+
+def has_valid_api_key(authorization: str | None) -> bool:
+    """Check a raw Authorization header the way verify_api_key does, for use outside routes"""
+    scheme, token = get_authorization_scheme_param(authorization)
+    return scheme.lower() == "bearer" and token == settings.api_key
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import time
+import urllib.parse
+from typing import TYPE_CHECKING, NamedTuple
+
+from .index import SQLiteStore
+
+if TYPE_CHECKING:
+    import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    url TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS sources_filename ON sources (filename);
+"""
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a source URL, so trivially different spellings share an entry"""
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = urllib.parse.urlencode(
+        sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    )
+    # The fragment never reaches the server, so it can't change the content
+    return urllib.parse.urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+class SourceRecord(NamedTuple):
+    filename: str
+    etag: str | None
+    last_modified: str | None
+    fetched: float
+
+
+class SourceCache(SQLiteStore):
+    """Remembers which stored file each source URL was uploaded as"""
+
+    schema = SCHEMA
+
+    def __init__(self, path: str, ttl: float = 86400) -> None:
+        super().__init__(path)
+        self.ttl = ttl
+
+    async def get(self, url: str) -> SourceRecord | None:
+        def get(conn: sqlite3.Connection) -> SourceRecord | None:
+            row = conn.execute(
+                "SELECT filename, etag, last_modified, fetched FROM sources WHERE url = ?", (url,)
+            ).fetchone()
+            return None if row is None else SourceRecord(*row)
+
+        return await self._run(get)
+
+    def is_fresh(self, record: SourceRecord) -> bool:
+        """Whether a record can be used without asking the source if it changed"""
+        return time.time() - record.fetched < self.ttl
+
+    async def put(
+        self, url: str, filename: str, etag: str | None, last_modified: str | None
+    ) -> None:
+        def put(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute(
+                    "INSERT INTO sources (url, filename, etag, last_modified, fetched) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET "
+                    "filename = excluded.filename, etag = excluded.etag, "
+                    "last_modified = excluded.last_modified, fetched = excluded.fetched",
+                    (url, filename, etag, last_modified, time.time()),
+                )
+
+        await self._run(put)
+
+    async def touch(self, url: str) -> None:
+        """Restart the TTL of a record the source confirmed is unchanged"""
+
+        def touch(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute("UPDATE sources SET fetched = ? WHERE url = ?", (time.time(), url))
+
+        await self._run(touch)
+
+    async def forget(self, filename: str) -> None:
+        """Drop every URL pointing at a file, e.g. once it is deleted"""
+
+        def forget(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute("DELETE FROM sources WHERE filename = ?", (filename,))
+
+        await self._run(forget)
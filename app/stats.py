@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+# What a scan reports: exact totals read in one step, or every file with its size
+type ScanResult = tuple[int, int] | dict[str, int]
+
+
+class FileStats:
+    """Running file count and total size, kept in memory by the storage provider"""
+
+    def __init__(self, reconcile_interval: float = 3600) -> None:
+        self.count = 0
+        self.total_size = 0
+        self.ready = False
+        self.reconcile_interval = reconcile_interval
+        self._task: asyncio.Task[None] | None = None
+        # Files added (with their size) or removed (None) while a scan runs
+        self._scan_changes: dict[str, int | None] | None = None
+
+    def add(self, filename: str, size: int) -> None:
+        self.count += 1
+        self.total_size += size
+        if self._scan_changes is not None:
+            self._scan_changes[filename] = size
+
+    def remove(self, filename: str, size: int) -> None:
+        self.count -= 1
+        self.total_size -= size
+        if self._scan_changes is not None:
+            self._scan_changes[filename] = None
+
+    def start(self, scan: Callable[[], Awaitable[ScanResult]]) -> None:
+        """Seed the totals in the background and periodically correct any drift"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._reconcile_loop(scan))
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    def _apply(self, result: ScanResult, changes: dict[str, int | None]) -> None:
+        if isinstance(result, tuple):
+            # Totals read in one step already include every change that finished before it
+            self.count, self.total_size = result
+            return
+
+        # A listing may or may not have seen a file changed while it ran, so the
+        # changes are applied by name, which counts each file exactly once
+        for filename, size in changes.items():
+            if size is None:
+                result.pop(filename, None)
+            else:
+                result[filename] = size
+        self.count, self.total_size = len(result), sum(result.values())
+
+    async def _reconcile_loop(self, scan: Callable[[], Awaitable[ScanResult]]) -> None:
+        while True:
+            self._scan_changes = {}
+            try:
+                result = await scan()
+            except Exception:
+                logger.exception("Failed to scan storage for file stats")
+            else:
+                self._apply(result, self._scan_changes)
+                self.ready = True
+            finally:
+                self._scan_changes = None
+
+            if self.reconcile_interval <= 0:
+                return
+            await asyncio.sleep(self.reconcile_interval)
@@ -1,36 +1,114 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
+import hashlib
+import math
+import mimetypes
+import os
+import string
+import time
 from abc import ABC, abstractmethod
-from typing import cast
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Literal, cast
 
 import aioboto3
-import aiofiles
 import aiofiles.os
 import fastapi
-from botocore.exceptions import ClientError
+from aiobotocore.config import AioConfig
+from botocore.exceptions import BotoCoreError, ClientError
 
 from .config import settings
+from .dedup import DedupIndex
+from .durability import AtomicWriter, GroupCommitter, supports_tmpfile
+from .index import FileIndex, FileRecord
+from .multipart import MultipartWriter
+from .presigns import PresignStore
+from .stats import FileStats, ScanResult
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncGenerator, AsyncIterator, Generator
+
+    from .durability import Durability
+
+# Every extension a variant may have been stored with, so deletes find all of them
+VARIANT_EXTENSIONS = ("webp", "avif")
+# How many S3 variant lookups are remembered, and for how long a miss is trusted
+VARIANT_CACHE_SIZE = 100_000
+VARIANT_MISS_TTL = 60
+# Files stat'ed per thread hop when streaming an unindexed local listing
+LISTING_BATCH_SIZE = 1000
+
+
+def variant_name(filename: str, extension: str) -> str:
+    """Name of an alternative encoding of a file, stored next to it
+
+    The leading dot keeps variants out of listings, counts and totals.
+    """
+    return f".{filename.rsplit('.', 1)[0]}.{extension}"
+
+
+async def content_digest(content: bytes) -> str:
+    """Hash identifying a file's content, computed off the event loop"""
+    # hashlib releases the GIL on large inputs, so a thread is enough
+    return await asyncio.to_thread(lambda: hashlib.blake2b(content).hexdigest())
 
 
 class StorageProvider(ABC):
     """Abstract base class for storage providers"""
 
+    async def start(self) -> None:  # noqa: B027
+        """Acquire long-lived resources, called once on startup"""
+
+    async def close(self) -> None:  # noqa: B027
+        """Release resources acquired in start(), called once on shutdown"""
+
     @abstractmethod
     async def save_file(self, filename: str, content: bytes) -> str:
         """Save file and return the accessible URL/path"""
 
+    @abstractmethod
+    async def save_stream(self, filename: str, chunks: AsyncIterator[bytes]) -> str:
+        """Save file from a stream of chunks and return the accessible URL/path"""
+
+    @abstractmethod
+    async def reuse(self, filename: str) -> bool:
+        """Hand out a stored file again for a repeated upload, returning False if it is gone"""
+
+    @abstractmethod
+    async def save_variant(self, filename: str, extension: str, content: bytes) -> None:
+        """Store an alternative encoding of a file next to it"""
+
     @abstractmethod
     async def delete_file(self, filename: str) -> None:
-        """Delete a file"""
+        """Delete a file along with its variants"""
 
     @abstractmethod
     async def get_file_url(self, filename: str) -> str:
         """Get the URL to access a file"""
 
+    @abstractmethod
+    async def read_file(self, filename: str) -> bytes:
+        """Read the full contents of a file"""
+
+    @abstractmethod
+    async def get_variant_url(self, filename: str, extension: str) -> str | None:
+        """Get the URL to access a variant of a file, or None if it has no such variant"""
+
     @abstractmethod
     async def list_files(self) -> dict[str, int]:
         """List all files with their sizes"""
 
+    @abstractmethod
+    def iter_files(
+        self, after: str | None = None, *, ordered: bool = True
+    ) -> AsyncGenerator[tuple[str, int]]:
+        """Yield (filename, size) pairs in filename order, starting after the given filename
+
+        With ordered=False, providers that would have to sort may yield in storage order.
+        """
+
     @abstractmethod
     async def get_file_count(self) -> int:
         """Get total number of files"""
@@ -43,67 +121,369 @@ class StorageProvider(ABC):
 class LocalStorageProvider(StorageProvider):
     """Local filesystem storage provider"""
 
-    def __init__(self, base_path: str = "files") -> None:
+    def __init__(  # noqa: PLR0913
+        self,
+        base_path: str = "files",
+        *,
+        index: FileIndex | None = None,
+        stats: FileStats | None = None,
+        dedup: DedupIndex | None = None,
+        scan_workers: int = 1,
+        shard_depth: int = 0,
+        durability: Durability = "none",
+        group_commit_window: float = 0.005,
+    ) -> None:
         self.base_path = base_path
+        self.index = index
+        self.stats = stats
+        self.dedup = dedup
+        self.scan_workers = scan_workers
+        self.shard_depth = shard_depth
+        self.durability: Durability = durability
+        self._shard_dirs: set[str] = set()
+        self._committer = GroupCommitter(group_commit_window) if durability == "group" else None
+        self._use_tmpfile = False
+
+    async def start(self) -> None:
+        self._use_tmpfile = await asyncio.to_thread(supports_tmpfile, self.base_path)
+
+        if self.index is not None:
+            await self.index.start()
+            await self.index.reconcile(await self._scan())
+
+        if self.dedup is not None:
+            await self.dedup.start()
+
+        if self.stats is not None:
+            self.stats.start(self._scan_totals)
+
+    async def close(self) -> None:
+        if self.stats is not None:
+            await self.stats.close()
+        if self.index is not None:
+            await self.index.close()
+        if self.dedup is not None:
+            await self.dedup.close()
+
+    async def _scan_totals(self) -> ScanResult:
+        if self.index is not None:
+            return await self.index.totals()
+
+        return {record.filename: record.size for record in await self._scan()}
+
+    async def _scan(self) -> list[FileRecord]:
+        """Stat every stored file without blocking the event loop"""
+        if self.scan_workers <= 1:
+            return await asyncio.to_thread(self._scan_records)
+
+        # On network filesystems each stat is a round trip, so spread them over threads
+        paths = await asyncio.to_thread(self._scan_paths)
+        chunk_size = max(1, -(-len(paths) // self.scan_workers))
+        results = await asyncio.gather(
+            *(
+                asyncio.to_thread(self._stat_records, paths[i : i + chunk_size])
+                for i in range(0, len(paths), chunk_size)
+            )
+        )
+        return [record for records in results for record in records]
+
+    def _walk(self) -> Generator[os.DirEntry[str]]:
+        """Yield every stored file, both inside shard directories and at the top level"""
+        pending = [(self.base_path, 0)]
+        while pending:
+            path, depth = pending.pop()
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    # Skips .gitkeep, variants and in-flight temporary files
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir():
+                        if depth < self.shard_depth:
+                            pending.append((entry.path, depth + 1))
+                    elif entry.is_file():
+                        yield entry
+
+    def _scan_records(self) -> list[FileRecord]:
+        """Single scandir pass using the stat data cached on each entry"""
+        records: list[FileRecord] = []
+        for entry in self._walk():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            records.append(FileRecord(entry.name, stat.st_size, stat.st_mtime))
+        return records
+
+    async def _stream_files(self) -> AsyncGenerator[tuple[str, int]]:
+        """Yield stored files in directory order as they are read, one batch in memory at a time"""
+        entries = self._walk()
+        try:
+            while batch := await asyncio.to_thread(self._next_batch, entries):
+                for item in batch:
+                    yield item
+        except FileNotFoundError as e:
+            raise fastapi.HTTPException(status_code=404, detail="Directory not found") from e
+        finally:
+            entries.close()
+
+    @staticmethod
+    def _next_batch(entries: Generator[os.DirEntry[str]]) -> list[tuple[str, int]]:
+        batch: list[tuple[str, int]] = []
+        for entry in entries:
+            try:
+                batch.append((entry.name, entry.stat().st_size))
+            except FileNotFoundError:
+                continue
+            if len(batch) >= LISTING_BATCH_SIZE:
+                break
+        return batch
+
+    def _scan_paths(self) -> list[str]:
+        return [entry.path for entry in self._walk()]
+
+    def _stat_records(self, paths: list[str]) -> list[FileRecord]:
+        records: list[FileRecord] = []
+        for path in paths:
+            try:
+                stat = Path(path).stat()
+            except FileNotFoundError:
+                continue
+            records.append(FileRecord(Path(path).name, stat.st_size, stat.st_mtime))
+        return records
+
+    def shard_path(self, filename: str) -> str:
+        """Where a file is stored in the configured layout"""
+        if self.shard_depth <= 0:
+            return f"{self.base_path}/{filename}"
+
+        digest = hashlib.blake2b(filename.encode(), digest_size=8).hexdigest()
+        shards = "/".join(digest[i * 2 : i * 2 + 2] for i in range(self.shard_depth))
+        return f"{self.base_path}/{shards}/{filename}"
+
+    async def _prepare_path(self, filename: str) -> str:
+        """Get the path to write a new file to, creating its shard directory if needed"""
+        file_path = self.shard_path(filename)
+        directory = file_path.rsplit("/", 1)[0]
+        if self.shard_depth > 0 and directory not in self._shard_dirs:
+            await aiofiles.os.makedirs(directory, exist_ok=True)
+            self._shard_dirs.add(directory)
+        return file_path
+
+    async def _resolve_path(self, filename: str) -> str:
+        """Locate an existing file, falling back to the flat layout for files not yet migrated"""
+        file_path = self.shard_path(filename)
+        if self.shard_depth <= 0 or await aiofiles.os.path.exists(file_path):
+            return file_path
+
+        flat_path = f"{self.base_path}/{filename}"
+        if await aiofiles.os.path.exists(flat_path):
+            return flat_path
+        # The file may have just been migrated into its shard
+        return file_path
+
+    async def _index_file(self, filename: str, file_path: str, digest: str | None) -> None:
+        """Record a freshly written file in the index, removing the file if that fails"""
+        if self.index is None:
+            return
+
+        try:
+            stat = await aiofiles.os.stat(file_path)
+            content_type, _ = mimetypes.guess_type(filename)
+            await self.index.add(
+                FileRecord(filename, stat.st_size, stat.st_mtime, content_type, digest)
+            )
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                await aiofiles.os.remove(file_path)
+            raise
+
+    def _writer(self, file_path: str) -> AtomicWriter:
+        return AtomicWriter(
+            file_path,
+            durability=self.durability,
+            committer=self._committer,
+            use_tmpfile=self._use_tmpfile,
+        )
 
     async def save_file(self, filename: str, content: bytes) -> str:
-        file_path = f"{self.base_path}/{filename}"
-        async with aiofiles.open(file_path, "wb") as file:
+        # Only the index and deduplication need the hash
+        digest = None
+        if self.index is not None or self.dedup is not None:
+            digest = await content_digest(content)
+        if self.dedup is not None and digest is not None:
+            owner = await self.dedup.acquire(digest)
+            if owner is not None:
+                return owner
+
+        file_path = await self._prepare_path(filename)
+        async with self._writer(file_path) as file:
             await file.write(content)
+            await file.commit()
+
+        owner = await self._record(filename, file_path, digest)
+        if owner == filename and self.stats is not None:
+            self.stats.add(filename, len(content))
+        return owner
+
+    async def save_stream(self, filename: str, chunks: AsyncIterator[bytes]) -> str:
+        file_path = await self._prepare_path(filename)
+        digest = hashlib.blake2b() if self.index is not None or self.dedup is not None else None
+        size = 0
+        # An aborted stream never becomes visible at file_path
+        async with self._writer(file_path) as file:
+            async for chunk in chunks:
+                if digest is not None:
+                    digest.update(chunk)
+                size += len(chunk)
+                await file.write(chunk)
+
+            # The hash is only known once the whole stream has been written, so a
+            # duplicate is dropped here by leaving the temporary file uncommitted
+            if self.dedup is not None and digest is not None:
+                owner = await self.dedup.acquire(digest.hexdigest())
+                if owner is not None:
+                    return owner
+
+            await file.commit()
+
+        owner = await self._record(
+            filename, file_path, digest.hexdigest() if digest is not None else None
+        )
+        if owner == filename and self.stats is not None:
+            self.stats.add(filename, size)
+        return owner
+
+    async def _record(self, filename: str, file_path: str, digest: str | None) -> str:
+        """Record a committed file and return the filename to hand out
+
+        If a concurrent upload of the same content was recorded first, this copy is
+        deleted and that upload's filename is returned instead.
+        """
+        if self.dedup is not None and digest is not None:
+            owner = await self.dedup.add(digest, filename)
+            if owner != filename:
+                with contextlib.suppress(FileNotFoundError):
+                    await aiofiles.os.remove(file_path)
+                return owner
+
+        try:
+            await self._index_file(filename, file_path, digest)
+        except BaseException:
+            await self._release(filename)
+            raise
         return filename
 
+    async def reuse(self, filename: str) -> bool:
+        # The reference is taken first, so a concurrent delete can't remove the file after the check
+        tracked = self.dedup is not None and await self.dedup.retain(filename)
+        if await aiofiles.os.path.exists(await self._resolve_path(filename)):
+            return True
+        if tracked:
+            await self._release(filename)
+        return False
+
+    async def _release(self, filename: str) -> None:
+        if self.dedup is None:
+            return
+        if await aiofiles.os.path.exists(await self._resolve_path(filename)):
+            await self.dedup.release(filename)
+        else:
+            # Uploads sharing the entry must not be handed a file that was never kept
+            await self.dedup.forget(filename)
+
+    def _variant_path(self, filename: str, extension: str) -> str:
+        directory = self.shard_path(filename).rsplit("/", 1)[0]
+        return f"{directory}/{variant_name(filename, extension)}"
+
+    async def save_variant(self, filename: str, extension: str, content: bytes) -> None:
+        await self._prepare_path(filename)
+        async with self._writer(self._variant_path(filename, extension)) as file:
+            await file.write(content)
+            await file.commit()
+
+    def _remove_variants(self, filename: str) -> None:
+        for extension in VARIANT_EXTENSIONS:
+            with contextlib.suppress(FileNotFoundError):
+                Path(self._variant_path(filename, extension)).unlink()
+
     async def delete_file(self, filename: str) -> None:
+        if self.dedup is not None and not await self.dedup.release(filename):
+            # Other uploads still share this file
+            return
+
+        await asyncio.to_thread(self._remove_variants, filename)
+        file_path = await self._resolve_path(filename)
         try:
-            await aiofiles.os.remove(f"{self.base_path}/{filename}")
+            stat = await aiofiles.os.stat(file_path)
+            await aiofiles.os.remove(file_path)
         except FileNotFoundError as e:
             raise fastapi.HTTPException(status_code=404, detail="File not found") from e
 
+        if self.index is not None:
+            await self.index.remove(filename)
+        if self.stats is not None:
+            self.stats.remove(filename, stat.st_size)
+
     async def get_file_url(self, filename: str) -> str:
-        return f"{self.base_path}/{filename}"
+        return await self._resolve_path(filename)
 
-    async def list_files(self) -> dict[str, int]:
+    async def get_variant_url(self, filename: str, extension: str) -> str | None:
+        variant_path = self._variant_path(filename, extension)
+        return variant_path if await aiofiles.os.path.exists(variant_path) else None
+
+    async def read_file(self, filename: str) -> bytes:
+        file_path = await self._resolve_path(filename)
         try:
-            files = await aiofiles.os.listdir(self.base_path)
+            return await asyncio.to_thread(Path(file_path).read_bytes)
         except FileNotFoundError as e:
-            raise fastapi.HTTPException(status_code=404, detail="Directory not found") from e
-
-        if ".gitkeep" in files:
-            files.remove(".gitkeep")
-
-        file_sizes: dict[str, int] = {}
-        for file in files:
-            file_path = f"{self.base_path}/{file}"
-            size = await aiofiles.os.path.getsize(file_path)
-            file_sizes[file] = size
+            raise fastapi.HTTPException(status_code=404, detail="File not found") from e
 
-        return file_sizes
+    async def list_files(self) -> dict[str, int]:
+        if self.index is not None:
+            return await self.index.list_files()
 
-    async def get_file_count(self) -> int:
         try:
-            files = await aiofiles.os.listdir(self.base_path)
+            records = await self._scan()
         except FileNotFoundError as e:
             raise fastapi.HTTPException(status_code=404, detail="Directory not found") from e
+        return {record.filename: record.size for record in records}
+
+    async def iter_files(
+        self, after: str | None = None, *, ordered: bool = True
+    ) -> AsyncGenerator[tuple[str, int]]:
+        if self.index is not None:
+            async for item in self.index.iter_files(after):
+                yield item
+            return
+
+        if not ordered and after is None:
+            async for item in self._stream_files():
+                yield item
+            return
+
+        # Without an index the directory has to be read in full to be ordered
+        files = await self.list_files()
+        for filename in sorted(files):
+            if after is None or filename > after:
+                yield filename, files[filename]
+
+    async def get_file_count(self) -> int:
+        if self.stats is not None and self.stats.ready:
+            return self.stats.count
+        if self.index is not None:
+            return await self.index.count()
 
-        if ".gitkeep" in files:
-            files.remove(".gitkeep")
+        files = await self.list_files()
         return len(files)
 
     async def get_total_size(self) -> int:
-        try:
-            files = await aiofiles.os.listdir(self.base_path)
-        except FileNotFoundError as e:
-            raise fastapi.HTTPException(status_code=404, detail="Directory not found") from e
+        if self.stats is not None and self.stats.ready:
+            return self.stats.total_size
+        if self.index is not None:
+            return await self.index.total_size()
 
-        if ".gitkeep" in files:
-            files.remove(".gitkeep")
-
-        total_size = 0
-        for file in files:
-            file_path = f"{self.base_path}/{file}"
-            size = await aiofiles.os.path.getsize(file_path)
-            total_size += size
-
-        return total_size
+        files = await self.list_files()
+        return sum(files.values())
 
 
 class S3StorageProvider(StorageProvider):
@@ -118,6 +498,17 @@ class S3StorageProvider(StorageProvider):
         bucket_name: str,
         region: str = "auto",
         custom_domain: str | None = None,
+        max_pool_connections: int = 50,
+        parallel_listing: bool = False,
+        listing_concurrency: int = 8,
+        presign_expiry: int = 3600,
+        multipart_threshold: int = 16 * 1024 * 1024,
+        multipart_part_size: int = 8 * 1024 * 1024,
+        multipart_concurrency: int = 4,
+        multipart_retries: int = 3,
+        stats: FileStats | None = None,
+        dedup: DedupIndex | None = None,
+        presigns: PresignStore | None = None,
     ) -> None:
         self.endpoint_url = endpoint_url
         self.access_key_id = access_key_id
@@ -125,51 +516,358 @@ class S3StorageProvider(StorageProvider):
         self.bucket_name = bucket_name
         self.region = region
         self.custom_domain = custom_domain
-
-    def _get_s3_session(self) -> aioboto3.Session:
-        """Create an async S3 session"""
-        return aioboto3.Session()
-
-    async def save_file(self, filename: str, content: bytes) -> str:
-        session = self._get_s3_session()
+        self.max_pool_connections = max_pool_connections
+        self.parallel_listing = parallel_listing
+        self.listing_concurrency = listing_concurrency
+        self.presign_expiry = presign_expiry
+        self.multipart_threshold = multipart_threshold
+        self.multipart_part_size = multipart_part_size
+        self.multipart_concurrency = multipart_concurrency
+        self.multipart_retries = multipart_retries
+        self.stats = stats
+        self.dedup = dedup
+        # Filenames handed out for direct uploads that haven't been completed yet
+        self.presigns = presigns
+
+        self._exit_stack: contextlib.AsyncExitStack | None = None
+        self._client: Any = None
+        # Whether each variant key exists, and until when a miss may be trusted
+        self._variants: OrderedDict[str, float] = OrderedDict()
+
+    @property
+    def s3(self) -> Any:
+        """The long-lived S3 client, available between start() and close()"""
+        if self._client is None:
+            msg = "S3 storage provider has not been started"
+            raise RuntimeError(msg)
+        return self._client
+
+    async def start(self) -> None:
+        if self._client is not None:
+            return
+
+        session = aioboto3.Session()
         s3_client = session.client(
             "s3",
             endpoint_url=self.endpoint_url,
             aws_access_key_id=self.access_key_id,
             aws_secret_access_key=self.secret_access_key,
             region_name=self.region,
+            # SigV4 is what R2 accepts, and it lets presigned PUTs sign their Content-Length
+            config=AioConfig(
+                max_pool_connections=self.max_pool_connections, signature_version="s3v4"
+            ),
         )
-        async with s3_client as s3:  # pyright: ignore[reportGeneralTypeIssues]
-            try:
-                await s3.put_object(
-                    Bucket=self.bucket_name, Key=filename, Body=content, ContentType="image/png"
-                )
-            except ClientError as e:
+        self._exit_stack = contextlib.AsyncExitStack()
+        self._client = await self._exit_stack.enter_async_context(s3_client)  # pyright: ignore[reportArgumentType]
+
+        if self.dedup is not None:
+            await self.dedup.start()
+        if self.presigns is not None:
+            await self.presigns.start()
+
+        if self.stats is not None:
+            self.stats.start(self._scan_totals)
+
+    async def close(self) -> None:
+        if self.stats is not None:
+            await self.stats.close()
+        if self.dedup is not None:
+            await self.dedup.close()
+        if self.presigns is not None:
+            await self.presigns.close()
+        if self._exit_stack is None:
+            return
+        await self._exit_stack.aclose()
+        self._exit_stack = None
+        self._client = None
+
+    async def save_file(self, filename: str, content: bytes) -> str:
+        digest = None
+        if self.dedup is not None:
+            digest = await content_digest(content)
+            owner = await self.dedup.acquire(digest)
+            if owner is not None:
+                return owner
+
+        try:
+            await self._put(filename, content)
+        except (BotoCoreError, ClientError) as e:
+            raise fastapi.HTTPException(
+                status_code=500, detail=f"Failed to upload file: {e!s}"
+            ) from e
+
+        owner = await self._record(filename, digest)
+        if owner == filename and self.stats is not None:
+            self.stats.add(filename, len(content))
+        return owner
+
+    async def _put(self, filename: str, content: bytes) -> None:
+        if len(content) < self.multipart_threshold:
+            await self.s3.put_object(
+                Bucket=self.bucket_name,
+                Key=filename,
+                Body=content,
+                ContentType=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+            )
+            return
+
+        async with self._multipart(filename) as upload:
+            await upload.write(content)
+            await upload.commit()
+
+    def _multipart(self, filename: str) -> MultipartWriter:
+        return MultipartWriter(
+            self.s3,
+            self.bucket_name,
+            filename,
+            content_type=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+            part_size=self.multipart_part_size,
+            concurrency=self.multipart_concurrency,
+            retries=self.multipart_retries,
+        )
+
+    async def save_stream(self, filename: str, chunks: AsyncIterator[bytes]) -> str:
+        # Small files go out in a single put_object, so only buffer up to the threshold
+        head = bytearray()
+        async for chunk in chunks:
+            head += chunk
+            if len(head) >= self.multipart_threshold:
+                break
+        else:
+            return await self.save_file(filename, bytes(head))
+
+        try:
+            return await self._save_multipart(filename, head, chunks)
+        except (BotoCoreError, ClientError) as e:
+            raise fastapi.HTTPException(
+                status_code=500, detail=f"Failed to upload file: {e!s}"
+            ) from e
+
+    async def _save_multipart(
+        self, filename: str, head: bytearray, chunks: AsyncIterator[bytes]
+    ) -> str:
+        # Only deduplication needs the hash
+        digest = hashlib.blake2b(head) if self.dedup is not None else None
+        size = len(head)
+        # An aborted stream never becomes visible under filename
+        async with self._multipart(filename) as upload:
+            await upload.write(head)
+            head.clear()
+            async for chunk in chunks:
+                if digest is not None:
+                    digest.update(chunk)
+                size += len(chunk)
+                await upload.write(chunk)
+
+            # As with local storage, the hash is only known at the end, so a
+            # duplicate is dropped by leaving the upload uncommitted
+            if self.dedup is not None and digest is not None:
+                owner = await self.dedup.acquire(digest.hexdigest())
+                if owner is not None:
+                    return owner
+
+            await upload.commit()
+
+        owner = await self._record(filename, digest.hexdigest() if digest is not None else None)
+        if owner == filename and self.stats is not None:
+            self.stats.add(filename, size)
+        return owner
+
+    async def reuse(self, filename: str) -> bool:
+        # The reference is taken first, so a concurrent delete can't remove the file after the check
+        tracked = self.dedup is not None and await self.dedup.retain(filename)
+        try:
+            await self.s3.head_object(Bucket=self.bucket_name, Key=filename)
+        except ClientError as e:
+            error_code = e.response.get("Error", {}).get("Code", "")
+            if error_code not in {"NoSuchKey", "404"}:
                 raise fastapi.HTTPException(
-                    status_code=500, detail=f"Failed to upload file: {e!s}"
+                    status_code=500, detail=f"Failed to look up file: {e!s}"
                 ) from e
-            else:
-                return filename
+            if tracked and self.dedup is not None:
+                # Nothing is stored, so no upload can use this entry
+                await self.dedup.forget(filename)
+            return False
+        return True
+
+    async def _record(self, filename: str, digest: str | None) -> str:
+        """Record an uploaded object for deduplication and return the filename to hand out
+
+        If a concurrent upload of the same content was recorded first, this copy is
+        deleted and that upload's filename is returned instead.
+        """
+        if self.dedup is None or digest is None:
+            return filename
+
+        owner = await self.dedup.add(digest, filename)
+        if owner != filename:
+            # A copy left behind only wastes space, so failing to delete it isn't an error
+            with contextlib.suppress(BotoCoreError, ClientError):
+                await self.s3.delete_object(Bucket=self.bucket_name, Key=filename)
+        return owner
+
+    async def presign_upload(
+        self, filename: str, *, method: Literal["put", "post"], size: int, max_size: int
+    ) -> dict[str, Any]:
+        """Let a client upload a file straight to the bucket, without going through the app
+
+        A PUT URL is signed for exactly `size` bytes, while a POST policy accepts
+        anything up to `max_size`.
+        """
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        if method == "put":
+            url = await self.s3.generate_presigned_url(
+                "put_object",
+                Params={
+                    "Bucket": self.bucket_name,
+                    "Key": filename,
+                    "ContentType": content_type,
+                    "ContentLength": size,
+                },
+                ExpiresIn=self.presign_expiry,
+            )
+            upload = {"url": url, "headers": {"Content-Type": content_type}}
+        else:
+            post = await self.s3.generate_presigned_post(
+                self.bucket_name,
+                filename,
+                Fields={"Content-Type": content_type},
+                Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, max_size]],
+                ExpiresIn=self.presign_expiry,
+            )
+            upload = {"url": post["url"], "fields": post["fields"]}
+
+        # An upload started just before the URL expires may still be finishing after it
+        await self._pending_uploads.add(filename, time.time() + 2 * self.presign_expiry)
+        return upload
+
+    @property
+    def _pending_uploads(self) -> PresignStore:
+        if self.presigns is None:
+            raise fastapi.HTTPException(status_code=501, detail="Direct uploads are not enabled")
+        return self.presigns
+
+    async def complete_upload(self, filename: str, max_size: int) -> int:
+        """Register a file uploaded through presign_upload() and return its size"""
+        if not await self._pending_uploads.pending(filename):
+            raise fastapi.HTTPException(status_code=404, detail="No pending upload for this file")
 
-    async def delete_file(self, filename: str) -> None:
-        session = self._get_s3_session()
-        s3_client = session.client(
-            "s3",
-            endpoint_url=self.endpoint_url,
-            aws_access_key_id=self.access_key_id,
-            aws_secret_access_key=self.secret_access_key,
-            region_name=self.region,
-        )
-        async with s3_client as s3:  # pyright: ignore[reportGeneralTypeIssues]
+        try:
+            head = await self.s3.head_object(Bucket=self.bucket_name, Key=filename)
+        except ClientError as e:
+            error_code = e.response.get("Error", {}).get("Code", "")
+            if error_code in {"NoSuchKey", "404"}:
+                raise fastapi.HTTPException(
+                    status_code=409, detail="File has not been uploaded yet"
+                ) from e
+            raise fastapi.HTTPException(
+                status_code=500, detail=f"Failed to look up file: {e!s}"
+            ) from e
+
+        # Completing twice must not count the file twice
+        if not await self._pending_uploads.complete(filename):
+            raise fastapi.HTTPException(status_code=404, detail="No pending upload for this file")
+
+        size = head["ContentLength"]
+        if size > max_size:
+            await self.s3.delete_object(Bucket=self.bucket_name, Key=filename)
+            raise fastapi.HTTPException(status_code=413, detail="File size exceeds limit")
+
+        if self.stats is not None:
+            self.stats.add(filename, size)
+        return size
+
+    async def save_variant(self, filename: str, extension: str, content: bytes) -> None:
+        key = variant_name(filename, extension)
+        try:
+            await self.s3.put_object(
+                Bucket=self.bucket_name,
+                Key=key,
+                Body=content,
+                ContentType=mimetypes.guess_type(key)[0] or "application/octet-stream",
+            )
+        except ClientError as e:
+            raise fastapi.HTTPException(
+                status_code=500, detail=f"Failed to upload variant: {e!s}"
+            ) from e
+        self._remember_variant(key, exists=True)
+
+    def _remember_variant(self, key: str, *, exists: bool) -> None:
+        # Variants never change once stored, so hits are kept until the file is deleted
+        self._variants[key] = math.inf if exists else time.monotonic() + VARIANT_MISS_TTL
+        self._variants.move_to_end(key)
+        while len(self._variants) > VARIANT_CACHE_SIZE:
+            self._variants.popitem(last=False)
+
+    async def get_variant_url(self, filename: str, extension: str) -> str | None:
+        key = variant_name(filename, extension)
+        expires = self._variants.get(key)
+        if expires is None or expires < time.monotonic():
             try:
-                await s3.delete_object(Bucket=self.bucket_name, Key=filename)
+                await self.s3.head_object(Bucket=self.bucket_name, Key=key)
             except ClientError as e:
                 error_code = e.response.get("Error", {}).get("Code", "")
-                if error_code == "NoSuchKey":
-                    raise fastapi.HTTPException(status_code=404, detail="File not found") from e
-                raise fastapi.HTTPException(
-                    status_code=500, detail=f"Failed to delete file: {e!s}"
-                ) from e
+                if error_code not in {"NoSuchKey", "404"}:
+                    raise fastapi.HTTPException(
+                        status_code=500, detail=f"Failed to look up variant: {e!s}"
+                    ) from e
+                self._remember_variant(key, exists=False)
+            else:
+                self._remember_variant(key, exists=True)
+            expires = self._variants[key]
+
+        return await self.get_file_url(key) if expires == math.inf else None
+
+    async def delete_file(self, filename: str) -> None:
+        if self.dedup is not None and not await self.dedup.release(filename):
+            # Other uploads still share this object
+            return
+
+        for extension in VARIANT_EXTENSIONS:
+            self._variants.pop(variant_name(filename, extension), None)
+
+        size = None
+        try:
+            # Variants go first, so a failure here leaves the original in place to retry
+            await self.s3.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={
+                    "Objects": [
+                        {"Key": variant_name(filename, extension)}
+                        for extension in VARIANT_EXTENSIONS
+                    ],
+                    "Quiet": True,
+                },
+            )
+            if self.stats is not None:
+                # delete_object doesn't report the size of what it removed
+                head = await self.s3.head_object(Bucket=self.bucket_name, Key=filename)
+                size = head["ContentLength"]
+            await self.s3.delete_object(Bucket=self.bucket_name, Key=filename)
+        except ClientError as e:
+            error_code = e.response.get("Error", {}).get("Code", "")
+            if error_code in {"NoSuchKey", "404"}:
+                raise fastapi.HTTPException(status_code=404, detail="File not found") from e
+            raise fastapi.HTTPException(
+                status_code=500, detail=f"Failed to delete file: {e!s}"
+            ) from e
+
+        if self.stats is not None and size is not None:
+            self.stats.remove(filename, size)
+
+    async def read_file(self, filename: str) -> bytes:
+        try:
+            response = await self.s3.get_object(Bucket=self.bucket_name, Key=filename)
+            async with response["Body"] as body:
+                return await body.read()
+        except ClientError as e:
+            error_code = e.response.get("Error", {}).get("Code", "")
+            if error_code in {"NoSuchKey", "404"}:
+                raise fastapi.HTTPException(status_code=404, detail="File not found") from e
+            raise fastapi.HTTPException(
+                status_code=500, detail=f"Failed to read file: {e!s}"
+            ) from e
 
     async def get_file_url(self, filename: str) -> str:
         # Use custom domain if provided
@@ -186,37 +884,73 @@ class S3StorageProvider(StorageProvider):
         # Standard AWS S3 URL format
         return f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{filename}"
 
+    async def _list_prefix(self, prefix: str = "") -> dict[str, int]:
+        """List every object under a prefix, following continuation tokens"""
+        paginator = self.s3.get_paginator("list_objects_v2")
+        file_sizes: dict[str, int] = {}
+        try:
+            async for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+                for obj in page.get("Contents", []):
+                    # Skip variants
+                    if not obj["Key"].startswith("."):
+                        file_sizes[obj["Key"]] = obj["Size"]
+        except ClientError as e:
+            raise fastapi.HTTPException(
+                status_code=500, detail=f"Failed to list files: {e!s}"
+            ) from e
+        return file_sizes
+
     async def list_files(self) -> dict[str, int]:
-        session = self._get_s3_session()
-        s3_client = session.client(
-            "s3",
-            endpoint_url=self.endpoint_url,
-            aws_access_key_id=self.access_key_id,
-            aws_secret_access_key=self.secret_access_key,
-            region_name=self.region,
-        )
-        async with s3_client as s3:  # pyright: ignore[reportGeneralTypeIssues]
-            try:
-                response = await s3.list_objects_v2(Bucket=self.bucket_name)
-            except ClientError as e:
-                raise fastapi.HTTPException(
-                    status_code=500, detail=f"Failed to list files: {e!s}"
-                ) from e
+        if not self.parallel_listing:
+            return await self._list_prefix()
+
+        # Generated filenames start with an ASCII letter, so the keyspace can be
+        # split by first character and each prefix listed concurrently
+        semaphore = asyncio.Semaphore(self.listing_concurrency)
+
+        async def list_with_limit(prefix: str) -> dict[str, int]:
+            async with semaphore:
+                return await self._list_prefix(prefix)
+
+        results = await asyncio.gather(*(list_with_limit(p) for p in string.ascii_letters))
 
-            file_sizes: dict[str, int] = {}
-            if "Contents" in response:
-                for obj in response["Contents"]:
-                    filename = obj["Key"]
-                    size = obj["Size"]
-                    file_sizes[filename] = size
+        file_sizes: dict[str, int] = {}
+        for result in results:
+            file_sizes.update(result)
+        return file_sizes
 
-            return file_sizes
+    async def iter_files(
+        self,
+        after: str | None = None,
+        *,
+        ordered: bool = True,  # noqa: ARG002
+    ) -> AsyncGenerator[tuple[str, int]]:
+        # Listings always come back in key order, so there is nothing to skip
+        paginator = self.s3.get_paginator("list_objects_v2")
+        try:
+            async for page in paginator.paginate(Bucket=self.bucket_name, StartAfter=after or ""):
+                for obj in page.get("Contents", []):
+                    if not obj["Key"].startswith("."):
+                        yield obj["Key"], obj["Size"]
+        except ClientError as e:
+            raise fastapi.HTTPException(
+                status_code=500, detail=f"Failed to list files: {e!s}"
+            ) from e
+
+    async def _scan_totals(self) -> ScanResult:
+        return await self.list_files()
 
     async def get_file_count(self) -> int:
+        if self.stats is not None and self.stats.ready:
+            return self.stats.count
+
         files = await self.list_files()
         return len(files)
 
     async def get_total_size(self) -> int:
+        if self.stats is not None and self.stats.ready:
+            return self.stats.total_size
+
         files = await self.list_files()
         return sum(files.values())
 
@@ -224,6 +958,9 @@ class S3StorageProvider(StorageProvider):
 def get_storage_provider() -> StorageProvider:
     """Factory function to get the appropriate storage provider"""
 
+    stats = FileStats(settings.stats_reconcile_interval) if settings.stats_enabled else None
+    dedup = DedupIndex(settings.dedup_index_path) if settings.dedup_enabled else None
+
     if settings.storage_type.lower() == "s3":
         if not all(
             [
@@ -244,5 +981,25 @@ def get_storage_provider() -> StorageProvider:
             bucket_name=cast("str", settings.s3_bucket_name),
             region=settings.s3_region,
             custom_domain=settings.s3_custom_domain,
+            max_pool_connections=settings.s3_max_pool_connections,
+            parallel_listing=settings.s3_parallel_listing,
+            listing_concurrency=settings.s3_listing_concurrency,
+            presign_expiry=settings.s3_presign_expiry,
+            multipart_threshold=settings.s3_multipart_threshold,
+            multipart_part_size=settings.s3_multipart_part_size,
+            multipart_concurrency=settings.s3_multipart_concurrency,
+            multipart_retries=settings.s3_multipart_retries,
+            stats=stats,
+            dedup=dedup,
+            presigns=PresignStore(settings.s3_presign_path),
         )
-    return LocalStorageProvider()
+    index = FileIndex(settings.local_index_path) if settings.local_index_enabled else None
+    return LocalStorageProvider(
+        index=index,
+        stats=stats,
+        dedup=dedup,
+        scan_workers=settings.local_scan_workers,
+        shard_depth=settings.local_shard_depth,
+        durability=settings.local_durability,
+        group_commit_window=settings.local_group_commit_window,
+    )
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import json
+import math
+from typing import TYPE_CHECKING
+
+import fastapi
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from .config import settings
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Mapping
+
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Room for what surrounds the file in a request body, such as JSON, a data: URL
+# prefix or multipart headers
+BODY_OVERHEAD = 64 * 1024
+
+
+def check_content_length(content_length: int | None, limit: int | None = None) -> None:
+    """Reject with 413 when a declared body length is already over the limit"""
+    limit = settings.filesize_limit if limit is None else limit
+    if content_length is not None and content_length > limit:
+        raise fastapi.HTTPException(status_code=413, detail="File size exceeds limit")
+
+
+async def limit_size(
+    chunks: AsyncIterator[bytes], limit: int | None = None
+) -> AsyncIterator[bytes]:
+    """Pass chunks through, aborting with 413 once the running total exceeds the limit"""
+    limit = settings.filesize_limit if limit is None else limit
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        if received > limit:
+            raise fastapi.HTTPException(status_code=413, detail="File size exceeds limit")
+        yield chunk
+
+
+async def read_body(request: fastapi.Request) -> bytes | bytearray:
+    """Read a request body into one buffer, without also holding its chunks at the same time"""
+    content_length = request.headers.get("content-length")
+    if not content_length or not content_length.isdigit():
+        return await request.body()
+
+    # The body size middleware has already capped Content-Length, so this is safe to allocate
+    body = bytearray(int(content_length))
+    received = 0
+    with memoryview(body) as view:
+        async for chunk in request.stream():
+            view[received : received + len(chunk)] = chunk
+            received += len(chunk)
+    del body[received:]
+    return body
+
+
+def base64_body_limit(size: int) -> int:
+    """Largest request body that can carry a file of `size` bytes as base64 in JSON"""
+    return 4 * math.ceil(size / 3) + BODY_OVERHEAD
+
+
+class BodySizeLimitMiddleware:
+    """Rejects request bodies over a per-path budget before the app reads or parses them"""
+
+    def __init__(self, app: ASGIApp, limits: Mapping[str, int], default: int) -> None:
+        self.app = app
+        self.limits = limits
+        self.default = default
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limits.get(scope["path"], self.default)
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                response = fastapi.responses.JSONResponse(
+                    status_code=413, content={"detail": "File size exceeds limit"}
+                )
+                await response(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                # Chunked bodies never declare their length, so they are cut off partway
+                if received > limit:
+                    raise fastapi.HTTPException(status_code=413, detail="File size exceeds limit")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class _MultipartFileExtractor:
+    """Incrementally extracts the contents of a single file field from a multipart body"""
+
+    def __init__(self, boundary: bytes, field_name: str) -> None:
+        self.field_name = field_name.encode()
+        self.found = False
+        self._chunks: list[bytes] = []
+        self._capturing = False
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._disposition = b""
+        self._parser = MultipartParser(
+            boundary,
+            callbacks={
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """Parse the next piece of the body and return any file data it contained"""
+        self._parser.write(data)
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+    def _on_part_begin(self) -> None:
+        self._disposition = b""
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if bytes(self._header_field).lower() == b"content-disposition":
+            self._disposition = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        self._capturing = not self.found and options.get(b"name") == self.field_name
+        self.found = self.found or self._capturing
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._capturing:
+            self._chunks.append(data[start:end])
+
+    def _on_part_end(self) -> None:
+        self._capturing = False
+
+
+async def iter_multipart_file(
+    request: fastapi.Request, field_name: str = "file"
+) -> AsyncIterator[bytes]:
+    """Yield the contents of a multipart file field as the request body arrives"""
+    _, options = parse_options_header(request.headers.get("content-type"))
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise fastapi.HTTPException(status_code=400, detail="Missing multipart boundary")
+
+    extractor = _MultipartFileExtractor(boundary, field_name)
+    async for data in request.stream():
+        for chunk in extractor.feed(data):
+            yield chunk
+
+    if not extractor.found:
+        raise fastapi.HTTPException(status_code=400, detail=f"Missing '{field_name}' field")
+
+
+async def encode_json_object(
+    items: AsyncIterator[tuple[str, int]], buffer_size: int = 64 * 1024
+) -> AsyncIterator[bytes]:
+    """Incrementally encode (key, value) pairs as a single JSON object"""
+    buffer = ["{"]
+    buffered = 1
+    separator = ""
+    async for key, value in items:
+        part = f"{separator}{json.dumps(key)}:{json.dumps(value)}"
+        buffer.append(part)
+        buffered += len(part)
+        separator = ","
+        if buffered >= buffer_size:
+            yield "".join(buffer).encode()
+            buffer.clear()
+            buffered = 0
+    buffer.append("}")
+    yield "".join(buffer).encode()
+
+
+async def encode_ndjson(
+    items: AsyncIterator[tuple[str, int]], buffer_size: int = 64 * 1024
+) -> AsyncIterator[bytes]:
+    """Encode (filename, size) pairs as newline-delimited JSON objects"""
+    buffer: list[str] = []
+    buffered = 0
+    async for filename, size in items:
+        line = json.dumps({"filename": filename, "size": size}) + "\n"
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= buffer_size:
+            yield "".join(buffer).encode()
+            buffer.clear()
+            buffered = 0
+    if buffer:
+        yield "".join(buffer).encode()
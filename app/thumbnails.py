@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from . import images
+from .config import settings
+from .durability import AtomicWriter
+from .workers import cpu_pool
+
+if TYPE_CHECKING:
+    from .storage import StorageProvider
+
+
+class ThumbnailCache:
+    """Resized images on local disk, evicted least recently used first to stay within a byte budget"""
+
+    def __init__(self, directory: str = "cache", max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task[str]] = {}
+
+    async def start(self) -> None:
+        """Pick up thumbnails left by the last run, oldest first"""
+        self._entries = OrderedDict(await asyncio.to_thread(self._scan))
+        self.total_bytes = sum(self._entries.values())
+        await self._evict()
+
+    def _scan(self) -> list[tuple[str, int]]:
+        Path(self.directory).mkdir(parents=True, exist_ok=True)
+        entries: list[tuple[float, str, int]] = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                # Skips in-flight temporary files
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        return [(name, size) for _, name, size in sorted(entries)]
+
+    @staticmethod
+    def key(filename: str, width: int | None, height: int | None, fit: str) -> str:
+        stem = filename.rsplit(".", 1)[0]
+        return f"{stem}.{width or 0}x{height or 0}.{fit}.png"
+
+    async def get(
+        self,
+        storage: StorageProvider,
+        filename: str,
+        width: int | None,
+        height: int | None,
+        fit: str,
+    ) -> str:
+        """Path of the resized image, creating it if it isn't cached yet"""
+        key = self.key(filename, width, height, fit)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return f"{self.directory}/{key}"
+
+        # Concurrent requests for the same thumbnail share a single resize
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(
+                self._create(storage, filename, key, width=width, height=height, fit=fit)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _create(  # noqa: PLR0913
+        self,
+        storage: StorageProvider,
+        filename: str,
+        key: str,
+        *,
+        width: int | None,
+        height: int | None,
+        fit: str,
+    ) -> str:
+        content = await storage.read_file(filename)
+        data = await cpu_pool.run(images.resize, content, width, height, fit)
+
+        path = f"{self.directory}/{key}"
+        async with AtomicWriter(path) as file:
+            await file.write(data)
+            await file.commit()
+
+        self._entries[key] = len(data)
+        self.total_bytes += len(data)
+        await self._evict()
+        return path
+
+    async def _evict(self) -> None:
+        # The newest entry is kept even if it alone is over budget
+        keys: list[str] = []
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            keys.append(key)
+        if keys:
+            await asyncio.to_thread(self._remove, keys)
+
+    def _remove(self, keys: list[str]) -> None:
+        for key in keys:
+            with contextlib.suppress(FileNotFoundError):
+                Path(self.directory, key).unlink()
+
+    async def discard(self, filename: str) -> None:
+        """Drop every cached thumbnail of a file, e.g. once it is deleted"""
+        prefix = filename.rsplit(".", 1)[0] + "."
+        for key, task in list(self._inflight.items()):
+            if key.startswith(prefix):
+                task.cancel()
+
+        keys = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            self.total_bytes -= self._entries.pop(key)
+        await asyncio.to_thread(self._remove, keys)
+
+
+# Create a global thumbnail cache instance
+thumbnail_cache = ThumbnailCache(settings.resize_cache_dir, settings.resize_cache_max_bytes)
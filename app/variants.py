@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from typing import TYPE_CHECKING, Any
+
+from . import images
+from .config import settings
+from .workers import cpu_pool
+
+if TYPE_CHECKING:
+    from .storage import StorageProvider
+
+logger = logging.getLogger(__name__)
+
+# Variant formats served to clients that accept them, smallest first
+PREFERRED_VARIANTS = ("avif", "webp")
+
+
+def accepted_variants(accept: str | None) -> list[str]:
+    """Configured variant extensions a client lists in its Accept header, most preferred first
+
+    Only explicitly listed types count, since a wildcard doesn't mean a client can
+    actually decode the newer formats.
+    """
+    if not accept or not settings.image_variants:
+        return []
+
+    qualities: dict[str, float] = {}
+    for item in accept.split(","):
+        media_type, *params = (part.strip() for part in item.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[media_type.lower()] = quality
+
+    accepted = [
+        ext
+        for ext in PREFERRED_VARIANTS
+        if ext in settings.image_variants and qualities.get(f"image/{ext}", 0) > 0
+    ]
+    return sorted(accepted, key=lambda ext: -qualities[f"image/{ext}"])
+
+
+class VariantGenerator:
+    """Encodes smaller variants of new uploads in the background
+
+    Uploads wait in a bounded queue for a fixed number of workers, so the memory held by
+    pending encodes is bounded too. Uploads arriving while the queue is full get no variants.
+    """
+
+    def __init__(self, workers: int = 1, queue_size: int = 1) -> None:
+        self.workers = workers
+        self.dropped = 0
+        self._queue: asyncio.Queue[tuple[StorageProvider, str, bytes]] = asyncio.Queue(queue_size)
+        # Queued files, which a cancel() removes so the workers skip them
+        self._pending: set[str] = set()
+        self._active: dict[str, asyncio.Task[None]] = {}
+        self._workers: list[asyncio.Task[None]] = []
+
+    def start(self) -> None:
+        if not settings.image_variants or self._workers:
+            return
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def schedule(self, storage: StorageProvider, filename: str, content: bytes) -> None:
+        """Queue generating the configured variants of a freshly stored file"""
+        if not self._workers or filename in self._pending or filename in self._active:
+            return
+
+        try:
+            self._queue.put_nowait((storage, filename, content))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Variant queue is full, not generating variants of %s", filename)
+            return
+        self._pending.add(filename)
+
+    async def cancel(self, filename: str) -> None:
+        """Stop generating variants of a file, so none are stored after it is deleted"""
+        self._pending.discard(filename)
+        task = self._active.pop(filename, None)
+        if task is None:
+            return
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for filename in list(self._active):
+            await self.cancel(filename)
+        self._pending.clear()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    def metrics(self) -> dict[str, Any]:
+        return {"queued": self._queue.qsize(), "active": len(self._active), "dropped": self.dropped}
+
+    async def _work(self) -> None:
+        while True:
+            await self._process(*await self._queue.get())
+
+    async def _process(self, storage: StorageProvider, filename: str, content: bytes) -> None:
+        if filename not in self._pending:
+            # Deleted while it was queued
+            return
+        self._pending.remove(filename)
+
+        task = asyncio.create_task(self._generate(storage, filename, content))
+        self._active[filename] = task
+        # wait() instead of awaiting the task, so cancelling a file doesn't stop the worker
+        await asyncio.wait([task])
+        self._active.pop(filename, None)
+
+    async def _generate(self, storage: StorageProvider, filename: str, content: bytes) -> None:
+        for extension in settings.image_variants:
+            try:
+                variant = await cpu_pool.run(
+                    images.to_variant, content, extension, settings.image_variant_quality
+                )
+                # Only worth keeping when it is actually smaller
+                if len(variant) < len(content):
+                    await storage.save_variant(filename, extension, variant)
+            except Exception:
+                logger.exception("Failed to generate %s variant of %s", extension, filename)
+
+
+# Create a global variant generator instance
+variant_generator = VariantGenerator(
+    max(settings.cpu_pool_workers, 1), settings.image_variant_queue_size
+)
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import asyncio
+import binascii
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any
+
+from PIL import Image
+
+from . import images
+from .config import settings
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+
+def _warm_up() -> None:
+    """Runs once per worker so process startup isn't paid by the first upload"""
+    Image.init()
+
+
+def _timed[T](func: Callable[..., T], *args: Any) -> tuple[T, float]:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class CPUPool:
+    """Worker pool that CPU-heavy upload stages run on instead of the event loop"""
+
+    def __init__(self) -> None:
+        self._executor: Executor | None = None
+        # Time spent on CPU-heavy work, split by where it ran
+        self.offloaded_calls = 0
+        self.offloaded_seconds = 0.0
+        self.inline_calls = 0
+        self.inline_seconds = 0.0
+
+    async def start(self) -> None:
+        """Create the pool and start every worker, should be called once on startup"""
+        if self._executor is not None or settings.cpu_pool_kind == "none":
+            return
+
+        workers = settings.cpu_pool_workers
+        if settings.cpu_pool_kind == "process":
+            # forkserver avoids forking a process that is already running threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("forkserver")
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="CPUPool")
+
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self._executor, _warm_up) for _ in range(workers))
+        )
+
+    async def close(self) -> None:
+        if self._executor is None:
+            return
+        await asyncio.to_thread(self._executor.shutdown)
+        self._executor = None
+
+    def _runs_inline(self, size: int | None) -> bool:
+        return self._executor is None or (
+            size is not None and size < settings.cpu_offload_threshold
+        )
+
+    async def run[T](self, func: Callable[..., T], *args: Any, size: int | None = None) -> T:
+        """Call func on the pool, or inline when the input size is too small to be worth the hop"""
+        if self._runs_inline(size):
+            result, elapsed = _timed(func, *args)
+            self.inline_calls += 1
+            self.inline_seconds += elapsed
+            return result
+
+        loop = asyncio.get_running_loop()
+        result, elapsed = await loop.run_in_executor(self._executor, _timed, func, *args)
+        self.offloaded_calls += 1
+        self.offloaded_seconds += elapsed
+        return result
+
+    async def b64decode(self, data: memoryview) -> bytes:
+        # a2b_base64 decodes straight from the view, where base64.b64decode would copy it first
+        if settings.cpu_pool_kind == "process" and not self._runs_inline(len(data)):
+            # Views can't be pickled, and worker processes get their own copy anyway
+            return await self.run(binascii.a2b_base64, bytes(data))
+        return await self.run(binascii.a2b_base64, data, size=len(data))
+
+    async def to_png(self, data: bytes) -> bytes:
+        # Even small images are slow to encode relative to their size, so always offload
+        return await self.run(images.to_png, data)
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "kind": settings.cpu_pool_kind if self._executor is not None else "none",
+            "offloaded_calls": self.offloaded_calls,
+            # Event loop time saved by running these calls on the pool
+            "offloaded_seconds": self.offloaded_seconds,
+            "inline_calls": self.inline_calls,
+            "inline_seconds": self.inline_seconds,
+        }
+
+
+# Create a global CPU pool instance
+cpu_pool = CPUPool()
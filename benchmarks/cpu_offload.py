@@ -0,0 +1,70 @@
+"""Compare event loop lag while concurrent base64 uploads are decoded.
+
+Usage: python -m benchmarks.cpu_offload [upload_count] [size_mb]
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.metrics import LoopLagMonitor
+
+
+async def decode_all(payloads: list[str], executor: Executor | None) -> None:
+    loop = asyncio.get_running_loop()
+
+    async def decode(payload: str) -> bytes:
+        if executor is None:
+            return base64.b64decode(payload)
+        return await loop.run_in_executor(executor, base64.b64decode, payload)
+
+    await asyncio.gather(*(decode(payload) for payload in payloads))
+
+
+async def run(label: str, payloads: list[str], executor: Executor | None) -> None:
+    if executor is not None:
+        # Warm up the pool so worker startup isn't measured
+        await decode_all(payloads[:1], executor)
+
+    monitor = LoopLagMonitor(interval=0.005)
+    monitor.start()
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    await decode_all(payloads, executor)
+    elapsed = time.perf_counter() - start
+    # Let the monitor record the wakeup that was delayed by the last decode
+    await asyncio.sleep(0.05)
+    await monitor.close()
+
+    lag = monitor.metrics()
+    print(  # noqa: T201
+        f"{label:<14} {elapsed * 1000:>8.1f} ms total  "
+        f"max lag {lag['max_lag_seconds'] * 1000:>7.1f} ms  "
+        f"blocked {lag['total_lag_seconds'] * 1000:>8.1f} ms"
+    )
+
+
+def main(upload_count: int, size_mb: int) -> None:
+    payload = base64.b64encode(os.urandom(size_mb * 1024 * 1024)).decode()
+    payloads = [payload] * upload_count
+    workers = min(upload_count, os.cpu_count() or 1)
+
+    asyncio.run(run("inline", payloads, None))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        asyncio.run(run("thread pool", payloads, executor))
+    context = multiprocessing.get_context("forkserver")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        asyncio.run(run("process pool", payloads, executor))
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 8, int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    )
@@ -0,0 +1,56 @@
+"""Compare local storage directory scans.
+
+Usage: python -m benchmarks.local_scan [file_count]
+"""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import aiofiles.os
+
+from app.storage import LocalStorageProvider
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable, Sized
+
+
+async def per_file_getsize(base_path: str) -> dict[str, int]:
+    """The previous implementation: one thread pool round trip per file"""
+    files = await aiofiles.os.listdir(base_path)
+    file_sizes: dict[str, int] = {}
+    for file in files:
+        file_sizes[file] = await aiofiles.os.path.getsize(f"{base_path}/{file}")
+    return file_sizes
+
+
+async def timed(label: str, func: Callable[[], Awaitable[Sized]]) -> None:
+    start = time.perf_counter()
+    result = await func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed * 1000:>9.1f} ms  ({len(result)} files)")  # noqa: T201
+
+
+async def run(base_path: str) -> None:
+    single = LocalStorageProvider(base_path)
+    parallel = LocalStorageProvider(base_path, scan_workers=8)
+
+    await timed("listdir + getsize per file", lambda: per_file_getsize(base_path))
+    await timed("scandir, one thread", single.list_files)
+    await timed("scandir, 8 stat threads", parallel.list_files)
+
+
+def main(file_count: int) -> None:
+    with tempfile.TemporaryDirectory() as base_path:
+        for i in range(file_count):
+            Path(base_path, f"{i:016d}.png").write_bytes(b"\0" * (i % 4096))
+        asyncio.run(run(base_path))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
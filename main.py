@@ -1,18 +1,107 @@
 from __future__ import annotations
 
-from typing import Annotated, Any
+import contextlib
+from typing import TYPE_CHECKING, Annotated, Any, Literal
 
 import fastapi
 import uvicorn
 
 from app import routes
-from app.models import UploadFileData
+from app.admission import AdmissionMiddleware, upload_admission
+from app.client import http_client
+from app.config import settings
+from app.idempotency import IdempotencyStore
+from app.jobs import JobStore, UploadJobQueue
+from app.metrics import loop_monitor
+from app.models import CompleteUploadData, PresignUploadData, parse_upload_body
 from app.security import verify_api_key
+from app.sources import SourceCache
 from app.storage import get_storage_provider
+from app.streaming import BODY_OVERHEAD, BodySizeLimitMiddleware, base64_body_limit, read_body
+from app.thumbnails import thumbnail_cache
+from app.variants import variant_generator
+from app.workers import cpu_pool
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncGenerator, Awaitable
 
 # Initialize storage provider
 storage = get_storage_provider()
-app = fastapi.FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+
+# Remembers which file each uploaded URL was stored as, when enabled
+source_cache = (
+    SourceCache(settings.source_cache_path, settings.source_cache_ttl)
+    if settings.source_cache_enabled
+    else None
+)
+
+# Responses of uploads made with an Idempotency-Key, when enabled
+idempotency = (
+    IdempotencyStore(settings.idempotency_path, settings.idempotency_window)
+    if settings.idempotency_enabled
+    else None
+)
+
+# Background queue for URL uploads, when enabled
+upload_jobs = (
+    UploadJobQueue(
+        JobStore(settings.upload_jobs_path),
+        lambda source: routes.save_url(source, storage, http_client.session, source_cache),
+        workers=settings.upload_jobs_workers,
+        retention=settings.upload_jobs_retention,
+    )
+    if settings.upload_jobs_enabled
+    else None
+)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_: fastapi.FastAPI) -> AsyncGenerator[None]:
+    loop_monitor.start()
+    await cpu_pool.start()
+    await http_client.start()
+    await storage.start()
+    await thumbnail_cache.start()
+    variant_generator.start()
+    if source_cache is not None:
+        await source_cache.start()
+    if idempotency is not None:
+        await idempotency.start()
+    if upload_jobs is not None:
+        await upload_jobs.start()
+    try:
+        yield
+    finally:
+        if upload_jobs is not None:
+            await upload_jobs.close()
+        await variant_generator.close()
+        if source_cache is not None:
+            await source_cache.close()
+        if idempotency is not None:
+            await idempotency.close()
+        await storage.close()
+        await http_client.close()
+        await cpu_pool.close()
+        await loop_monitor.close()
+
+
+app = fastapi.FastAPI(docs_url=None, redoc_url=None, openapi_url=None, lifespan=lifespan)
+# Turn away uploads over capacity before their body is read
+app.add_middleware(
+    AdmissionMiddleware,
+    admission=upload_admission,
+    paths={"/upload", "/upload/stream"},
+    retry_after=settings.upload_retry_after,
+)
+# Added last so it runs first, and oversized bodies never take an upload slot
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={
+        "/upload": base64_body_limit(settings.filesize_limit),
+        "/upload/stream": settings.filesize_limit + BODY_OVERHEAD,
+    },
+    default=BODY_OVERHEAD,
+)
 
 
 @app.get("/")
@@ -35,16 +124,65 @@ async def health() -> fastapi.responses.JSONResponse:
     return routes.health_check()
 
 
+@app.get("/metrics")
+async def get_metrics(
+    _: Annotated[str, fastapi.Depends(verify_api_key)],
+) -> fastapi.responses.JSONResponse:
+    return routes.metrics()
+
+
 @app.post("/upload")
 async def upload(
-    data: UploadFileData, _: Annotated[str, fastapi.Depends(verify_api_key)]
+    request: fastapi.Request,
+    _: Annotated[str, fastapi.Depends(verify_api_key)],
+    idempotency_key: Annotated[str | None, fastapi.Header()] = None,
+) -> fastapi.responses.Response:
+    # Parsed by hand, as the generic JSON and model path copies large sources several times
+    source = parse_upload_body(await read_body(request))
+
+    def handler() -> Awaitable[fastapi.responses.JSONResponse]:
+        return routes.upload_file(source, storage, http_client.session, upload_jobs, source_cache)
+
+    if idempotency is None or idempotency_key is None:
+        return await handler()
+    return await idempotency.run(idempotency_key, await routes.upload_fingerprint(source), handler)
+
+
+@app.post("/upload/stream")
+async def upload_stream(
+    request: fastapi.Request, _: Annotated[str, fastapi.Depends(verify_api_key)]
+) -> fastapi.responses.JSONResponse:
+    return await routes.upload_stream(request, storage)
+
+
+@app.post("/upload/presign")
+async def upload_presign(
+    data: PresignUploadData, _: Annotated[str, fastapi.Depends(verify_api_key)]
+) -> fastapi.responses.JSONResponse:
+    return await routes.presign_upload(data, storage)
+
+
+@app.post("/upload/complete")
+async def upload_complete(
+    data: CompleteUploadData, _: Annotated[str, fastapi.Depends(verify_api_key)]
+) -> fastapi.responses.JSONResponse:
+    return await routes.complete_upload(data, storage)
+
+
+@app.get("/jobs/{job_id}")
+async def job(
+    job_id: str, _: Annotated[str, fastapi.Depends(verify_api_key)]
 ) -> fastapi.responses.JSONResponse:
-    return await routes.upload_file(data, storage)
+    return await routes.get_job(job_id, upload_jobs)
 
 
 @app.get("/files")
-async def files() -> fastapi.responses.JSONResponse:
-    return await routes.list_files(storage)
+async def files(
+    limit: Annotated[int | None, fastapi.Query(ge=1, le=10_000)] = None,
+    cursor: str | None = None,
+    output: Annotated[Literal["json", "ndjson"], fastapi.Query(alias="format")] = "json",
+) -> fastapi.responses.StreamingResponse:
+    return await routes.list_files(storage, limit=limit, cursor=cursor, output=output)
 
 
 @app.get("/files/count")
@@ -61,12 +199,18 @@ async def files_size() -> fastapi.responses.JSONResponse:
 async def delete(
     filename: str, _: Annotated[str, fastapi.Depends(verify_api_key)]
 ) -> fastapi.responses.JSONResponse:
-    return await routes.delete_file(filename, storage)
+    return await routes.delete_file(filename, storage, source_cache)
 
 
 @app.get("/{filename}", response_model=None)
-async def file(filename: str) -> Any:
-    return await routes.get_file(filename, storage)
+async def file(
+    filename: str,
+    w: Annotated[int | None, fastapi.Query(ge=1)] = None,
+    h: Annotated[int | None, fastapi.Query(ge=1)] = None,
+    fit: Literal["contain", "cover", "fill"] = "contain",
+    accept: Annotated[str | None, fastapi.Header()] = None,
+) -> Any:
+    return await routes.get_file(filename, storage, accept=accept, width=w, height=h, fit=fit)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+"""Move flat files in local storage into the sharded layout set by LOCAL_SHARD_DEPTH.
+
+Safe to run while the app is serving: each file is moved with an atomic rename and
+the app falls back to the flat path for files that haven't been moved yet.
+
+Usage: python migrate_to_shards.py
+"""
+
+from __future__ import annotations
+
+import contextlib
+import os
+from pathlib import Path
+
+from app.config import settings
+from app.storage import VARIANT_EXTENSIONS, LocalStorageProvider, variant_name
+
+
+def migrate(storage: LocalStorageProvider) -> tuple[int, int]:
+    moved = skipped = 0
+    with os.scandir(storage.base_path) as entries:
+        for entry in entries:
+            # Variants are moved together with their original below
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+
+            target = Path(storage.shard_path(entry.name))
+            if target.exists():
+                skipped += 1
+                continue
+
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                Path(entry.path).rename(target)
+            except FileNotFoundError:
+                # Deleted while we were migrating
+                continue
+            moved += 1
+
+            for extension in VARIANT_EXTENSIONS:
+                variant = Path(storage.base_path, variant_name(entry.name, extension))
+                with contextlib.suppress(FileNotFoundError):
+                    variant.rename(target.parent / variant.name)
+
+            if moved % 10_000 == 0:
+                print(f"Moved {moved} files")  # noqa: T201
+
+    return moved, skipped
+
+
+def main() -> None:
+    if settings.local_shard_depth <= 0:
+        msg = "Set LOCAL_SHARD_DEPTH to a positive number before migrating"
+        raise SystemExit(msg)
+
+    moved, skipped = migrate(LocalStorageProvider(shard_depth=settings.local_shard_depth))
+    print(f"Done, moved {moved} files, skipped {skipped} already in place")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()